@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import matplotlib
+import argparse
+import datetime
+import platform
+import tempfile
+import shutil
+import json
+import time
+import os
+import io
+import sys
+import covid19_linear_plot as covid19
+from covid19_linear_plot import Covid19Data, Covid19Dataset, Covid19PlotRenderer, DataLocation
+"""
+
+Benchmarks of the COVID-19 Linear Plot Tool
+
+Times the stages of a plot separately (CSV load, location lookup, date resolution, data slicing, fit and
+rendering) on the bundled Johns Hopkins time series file and on synthetic files with more rows (locations)
+and more columns (dates). The results are written as JSON so runs on different library versions can be compared.
+
+"""
+
+DEFAULT_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'time_series_covid19_confirmed_global.csv')
+
+# Scales of the synthetic data as rows x columns of the bundled file
+DEFAULT_SCALES = ['1x1', '10x1', '1x10', '100x1', '1x100', '10x10']
+
+# Number of days in the plotted date window
+WINDOW_DAYS = 30
+
+def make_synthetic_csv(df, row_scale, column_scale, path, seed=0):
+    """ Write a synthetic time series file in the Johns Hopkins layout, scaled from a real one.
+
+    Parameters:
+        df
+            Data frame of the real file
+        row_scale
+            Number of copies of every row, copies get a numbered province/state and country/region, e.g. Italy 2
+        column_scale
+            The dates are extended to column_scale times as many days, the cases keep growing by random daily increments
+        path
+            Path of the written CSV file
+
+    """
+    rng = np.random.default_rng(seed)
+    dates = covid19.parse_csv_dates(df.columns[4:])
+    counts = df.iloc[:, 4:].to_numpy(dtype=np.int64)
+
+    #New days continue from the last day with increments drawn around the last week's daily increments
+    n_days = len(dates) * column_scale
+    if n_days > len(dates):
+        daily = np.maximum(np.diff(counts[:, -8:], axis=1).mean(axis=1), 0)
+        increments = rng.poisson(daily[:, np.newaxis], size=(counts.shape[0], n_days - len(dates)))
+        counts = np.hstack([counts, counts[:, -1:] + np.cumsum(increments, axis=1)])
+    all_dates = dates[0] + np.arange(n_days)
+    date_columns = ['%d/%d/%02d' %(d.month, d.day, d.year % 100) for d in all_dates.astype(datetime.date)]
+
+    copies = []
+    for copy in range(row_scale):
+        location_columns = df.iloc[:, :4].copy()
+        if copy > 0:
+            suffix = ' %d' % (copy + 1)
+            location_columns['Province/State'] = location_columns['Province/State'].where(location_columns['Province/State'].isna(),
+                                                                                          location_columns['Province/State'] + suffix)
+            location_columns['Country/Region'] = location_columns['Country/Region'] + suffix
+        copies.append(location_columns)
+
+    synthetic = pd.concat(copies, ignore_index=True)
+    synthetic = pd.concat([synthetic, pd.DataFrame(np.tile(counts, (row_scale, 1)), columns=date_columns)], axis=1)
+    synthetic.to_csv(path, index=False)
+
+def time_stage(function, repeat):
+    """Run function repeat times, returns the timings summary and the last result."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': float(np.median(timings)), 'mean': float(np.mean(timings)), 'repeat': repeat}, result
+
+def benchmark_file(path, repeat, locations_per_stage):
+    """ Time every stage on one time series file.
+
+    Returns:
+        Dict of the stage names and their timings summaries, in seconds
+
+    """
+    stages = {}
+
+    stages['load_csv'], dataset = time_stage(lambda: Covid19Dataset(path), repeat)
+
+    #A sample of locations spread over the file, used by the lookup, date and slicing stages
+    names = dataset.location_names(DataLocation.province_state)
+    countries = dataset.location_names(DataLocation.country_region)
+    locations = [(name, DataLocation.province_state) for name in names[::max(1, len(names) // locations_per_stage)]][:locations_per_stage] + \
+                [(name, DataLocation.country_region) for name in countries[::max(1, len(countries) // locations_per_stage)]][:locations_per_stage]
+
+    stages['find_location'], _ = time_stage(lambda: [dataset.find_location(name, data_location) for name, data_location in locations], repeat)
+    stages['location_frame'], data_list = time_stage(lambda: [Covid19Data(name, path, data_location, dataset=dataset) for name, data_location in locations], repeat)
+
+    start_date = covid19.get_readable_date(dataset.date_columns[-WINDOW_DAYS])
+    end_date = covid19.get_readable_date(dataset.date_columns[-1])
+    stages['set_start_end_dates'], date_indices = time_stage(lambda: [data.set_start_end_dates(start_date, end_date) for data in data_list], repeat)
+    stages['get_covid19_data'], covid19_data = time_stage(lambda: [data.get_covid19_data(indices) for data, indices in zip(data_list, date_indices)], repeat)
+    stages['fit'], fits = time_stage(lambda: [data.fit(x_y_dates) for data, x_y_dates in zip(data_list, covid19_data)], repeat)
+    stages['batch_fit'], _ = time_stage(lambda: covid19.batch_fit(dataset, start_date, end_date), repeat)
+
+    #Render the first location into memory, the figure is built once and reused like in bulk rendering
+    renderer = Covid19PlotRenderer()
+    data, x_y_dates, (ln_y, fit_line, fit) = data_list[0], covid19_data[0], fits[0]
+    def render():
+        renderer.draw(data.location, x_y_dates.x01_plot_data, x_y_dates.y01_plot_data, ln_y, fit_line, fit.slope, fit.r_squared,
+                      fit.r0, fit.doubling_time, start_date, end_date)
+        renderer.save(io.BytesIO(), 'png')
+    stages['render'], _ = time_stage(render, repeat)
+
+    stages['new_figure'], _ = time_stage(lambda: Covid19PlotRenderer(), repeat)
+
+    return {'rows': int(dataset.counts.shape[0]), 'columns': int(dataset.counts.shape[1]), 'locations_per_stage': len(locations), 'stages': stages}
+
+def main():
+
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument('-u',
+                            '--url',
+                            type=str,
+                            default=DEFAULT_DATA_FILE,
+                            help='COVID-19 data file used as the 1x1 scale and to build the synthetic files, default is the bundled file')
+        parser.add_argument('--scales',
+                            type=str,
+                            default=','.join(DEFAULT_SCALES),
+                            help='Comma separated ROWSxCOLUMNS scales of the data, e.g. 10x1 has 10 times the rows. Default is %s' % ','.join(DEFAULT_SCALES))
+        parser.add_argument('-r',
+                            '--repeat',
+                            type=int,
+                            default=5,
+                            help='Number of times each stage is timed')
+        parser.add_argument('-n',
+                            '--locations',
+                            type=int,
+                            default=20,
+                            help='Number of provinces/states and of countries/regions used in the per-location stages')
+        parser.add_argument('-o',
+                            '--output',
+                            type=str,
+                            help='Write the results to this JSON file, otherwise they are printed')
+        args = parser.parse_args()
+
+        results = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+                            'pandas': pd.__version__, 'matplotlib': matplotlib.__version__},
+            'data_file': args.url,
+            'benchmarks': [],
+        }
+
+        df = pd.read_csv(args.url)
+        work_dir = tempfile.mkdtemp(prefix='covid19_benchmark_')
+        try:
+            for scale in args.scales.split(','):
+                row_scale, column_scale = (int(value) for value in scale.lower().split('x'))
+                if row_scale == 1 and column_scale == 1:
+                    path = args.url
+                else:
+                    path = os.path.join(work_dir, 'synthetic_%s.csv' % scale)
+                    make_synthetic_csv(df, row_scale, column_scale, path)
+
+                print('Benchmarking scale %s' % scale, file=sys.stderr)
+                benchmark = benchmark_file(path, args.repeat, args.locations)
+                benchmark['scale'] = scale
+                results['benchmarks'].append(benchmark)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print('Wrote benchmark results to %s' % args.output, file=sys.stderr)
+        else:
+            print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
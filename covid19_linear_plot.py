@@ -1,13 +1,27 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import colors
 import argparse
 import datetime
-from dateutil.parser import parse
-import pandas as pd
-import platform
+import calendar
 import collections
 from enum import Enum
+import os
+import io
+import json
+import time
+import hashlib
+import csv
+import difflib
+import re
+import itertools
+import concurrent.futures
+import contextlib
+import functools
+import tracemalloc
+import cProfile
+import sys
+import threading
+import urllib.parse
+from covid19_statistics import fit_statistics, bootstrap_intervals, DEFAULT_RESAMPLES, DEFAULT_CONFIDENCE
 """
 
 COVID-19 (Coronavirus) Linear Plot Tool With Start and End Dates to Analyze Curve Flattening
@@ -25,43 +39,720 @@ class DataLocation(Enum):
     country_region = 2
     world = 3
 
-class Covid19Data:
+# Allow date in format of mm/dd/YYYY or mm/dd/yy feb/29/20 or feb/29/2020 or ISO 2020-02-29 etc.
+DATE_FORMATS = ['%m/%d/%Y', '%m/%d/%y', '%b/%d/%y', '%b/%d/%Y', '%B/%d/%Y', '%m-%d-%Y', '%m-%d-%y', '%b-%d-%y', '%b-%d-%Y', '%B-%d-%Y', '%Y-%m-%d']
+
+# Date format of the column headers in the Johns Hopkins data, e.g. 2/9/20
+CSV_DATE_FORMAT = '%m/%d/%y'
+
+# Fit statistics of the log-linear model, each field holds one value per location
+FitResult = collections.namedtuple('FitResult', ['slope', 'intercept', 'r_squared', 'doubling_time', 'r0'])
+
+# Covid19Timings objects recording the stages, see stage_timer
+_active_timings = []
+
+# Guards _active_timings, _stage_memory and the tracemalloc peak, stages run in the loader and server threads too
+_timings_lock = threading.Lock()
 
-    def __init__(self, location, url, data_location):
+class Covid19Timings:
+    """Records the wall time and peak memory of the load, select, dates, slice, quality, fit and render stages while it is active.
+
+    Use it as a context manager around library calls, e.g. with Covid19Timings(callback=send_metric) as timings: ...
+    The callback is called with the stage name, wall time in seconds and peak memory in bytes after every stage.
+    Stages can be nested, e.g. a load inside a select, then the outer stage includes the inner stage.
+
+    The peak memory is only measured with trace_memory, otherwise it is None. Tracing every allocation with tracemalloc
+    slows the stages that allocate many Python objects, e.g. parsing the CSV file, several times more than the
+    numpy stages, so time without it and measure the memory in a separate run. The traced memory is the memory of
+    the process, so the peak of a stage includes the allocations of stages running at the same time in other threads.
+    """
+
+    def __init__(self, trace_memory=False, callback=None):
         """Constructor"""
-        #index location of world row index, only used when we want world total
-        self.world_row_index = -1
-        self._location = location
-        self._url = url
-        self._data_location = data_location
-        self._csv_date_format = None
+        self._trace_memory = trace_memory
+        self._callback = callback
+        self._started_tracing = False
+        self._records = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with _timings_lock:
+            if self._trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            _active_timings.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with _timings_lock:
+            _active_timings.remove(self)
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
 
-        #Load the row that contains for specific state or province and its COVID-19 data
-        df = pd.read_csv(url, error_bad_lines=False)
+    @property
+    def records(self):
+        return self._records
+
+    def record(self, stage, seconds, peak_memory):
+        with self._lock:
+            self._records.append({'stage': stage, 'seconds': seconds, 'peak_memory': peak_memory})
+        if self._callback is not None:
+            self._callback(stage, seconds, peak_memory)
+
+    def summary(self):
+        """Total seconds, number of calls and largest peak memory of each stage."""
+        stages = {}
+        with self._lock:
+            records = list(self._records)
+        for record in records:
+            stage = stages.setdefault(record['stage'], {'seconds': 0.0, 'calls': 0, 'peak_memory': None})
+            stage['seconds'] += record['seconds']
+            stage['calls'] += 1
+            if record['peak_memory'] is not None:
+                stage['peak_memory'] = max(stage['peak_memory'] or 0, record['peak_memory'])
+        return stages
+
+    def to_json(self):
+        return json.dumps({'stages': self.summary(), 'records': self._records}, indent=2)
+
+# Traced memory at the start and the peak so far of every running stage, of all threads
+_stage_memory = []
+
+def _update_stage_peaks():
+    """Add the traced peak to the peaks of all running stages, called with _timings_lock held before the peak is reset or read."""
+    peak = tracemalloc.get_traced_memory()[1]
+    for memory in _stage_memory:
+        memory[1] = max(memory[1], peak)
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Time a stage for the active Covid19Timings, does nothing when none is active."""
+    #Checked without the lock first, reading the list is safe and the stages are not timed in most runs
+    if not _active_timings:
+        yield
+        return
+
+    with _timings_lock:
+        active_timings = list(_active_timings)
+        memory = None
+        #Every running stage, nested or in another thread, keeps its peak so far, the peak is then reset to measure this stage
+        if active_timings and tracemalloc.is_tracing():
+            _update_stage_peaks()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            memory = [current, current]
+            _stage_memory.append(memory)
+    if not active_timings:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_memory = None
+        if memory is not None:
+            with _timings_lock:
+                if tracemalloc.is_tracing():
+                    _update_stage_peaks()
+                #Removed by identity, stages of other threads can have the same values
+                _stage_memory[:] = [other for other in _stage_memory if other is not memory]
+            peak_memory = memory[1] - memory[0]
+        for timings in active_timings:
+            timings.record(stage, seconds, peak_memory)
+
+def timed_stage(stage):
+    """Decorator timing every call of a function as a stage, see stage_timer."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ISO dates, e.g. 2020-03-21, and the m/d/yy or m/d/yyyy dates of the column headers, parsed without strptime
+ISO_DATE_PATTERN = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+SLASH_DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})')
+
+def _make_date(year, month, day):
+    """datetime of the year, month and day, None if the month or day is out of range."""
+    year, month, day = int(year), int(month), int(day)
+    if not (1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]):
+        return None
+    return datetime.datetime(year, month, day)
+
+def parse_date(value):
+    """ Parse a date entered by the user, returns None if no format in DATE_FORMATS matches.
+
+    datetime, date and datetime64 values are returned as they are, so sweeps over many dates skip the parsing.
+    ISO and m/d/yy dates are matched first without trying every format.
+    """
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return None if isinstance(value, np.datetime64) and np.isnat(value) else value
+    if not isinstance(value, str):
+        return None
+
+    match = ISO_DATE_PATTERN.fullmatch(value)
+    if match:
+        return _make_date(*match.groups())
+    match = SLASH_DATE_PATTERN.fullmatch(value)
+    if match:
+        month, day, year = match.groups()
+        return _make_date(int(year) + 2000 if len(year) == 2 else year, month, day)
+
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def parse_csv_dates(columns):
+    """Parse the m/d/yy date column headers once, into a datetime64[D] array."""
+    iso_dates = []
+    for col in columns:
+        month, day, year = col.split('/')
+        year = int(year) + 2000 if len(year) == 2 else int(year)
+        iso_dates.append('%04d-%02d-%02d' %(year, int(month), int(day)))
+    return np.array(iso_dates, dtype='datetime64[D]')
+
+def find_date_position(dates, date, snap=False):
+    """ Find the position of a date in a sorted datetime64[D] array with a binary search.
+
+    Parameters:
+        dates
+            Sorted datetime64[D] array, e.g. from parse_csv_dates
+        date
+            datetime or datetime64 to find
+        snap
+            If True, a date that is not in the data is moved to the nearest available date
+
+    Returns:
+        Position of the date, or None if it is not in the data and snap is False
+
+    """
+    date = np.datetime64(date, 'D')
+    pos = int(np.searchsorted(dates, date))
+    if pos < len(dates) and dates[pos] == date:
+        return pos
+    if not snap or len(dates) == 0:
+        return None
+    if pos == 0:
+        return 0
+    if pos == len(dates):
+        return len(dates) - 1
+    return pos if dates[pos] - date < date - dates[pos-1] else pos - 1
+
+# Returns readable date, e.g. Mar/31/2020 instead of 03/31/20
+def get_readable_date(csv_date):
+    try:
+        date_label = datetime.datetime.strptime(csv_date, CSV_DATE_FORMAT)
+        return datetime.datetime.strftime(date_label, '%b/%d/%Y')
+    except (TypeError, ValueError):
+        return 'Invalid Date'
+
+def compact_counts(values):
+    """Case values as a contiguous int32 matrix, or int64 if some values do not fit in int32."""
+    values = np.asarray(values)
+    limits = np.iinfo(np.int32)
+    if values.size and (values.min() < limits.min or values.max() > limits.max):
+        return np.ascontiguousarray(values, dtype=np.int64)
+    return np.ascontiguousarray(values, dtype=np.int32)
+
+# Columns of a time series file read by read_time_series_csv
+TimeSeriesTable = collections.namedtuple('TimeSeriesTable', ['provinces', 'countries', 'lat', 'long', 'date_columns', 'counts'])
+
+def read_time_series_csv(content, date_columns=None):
+    """ Read a Johns Hopkins time series file with the csv module, without Pandas.
+
+    Parameters:
+        content
+            Content of the CSV file as bytes
+        date_columns
+            Names of the date columns to read, default is every date column of the file. Raises ValueError if one is missing.
+
+    Returns:
+        TimeSeriesTable of the province/state names ('' if none), country/region names, latitudes and longitudes
+        (NaN if missing), the date column names and the case values as a compact_counts matrix. Rows that do not have
+        as many fields as the header are skipped, same as Pandas with error_bad_lines=False.
+
+    """
+    reader = csv.reader(io.StringIO(content.decode('utf-8-sig')))
+    header = next(reader, [])
+    if date_columns is None:
+        date_columns = header[4:]
+        positions = None
+    else:
+        positions = [header.index(column) for column in date_columns]
+
+    provinces, countries, lat, long, values = [], [], [], [], []
+    for fields in reader:
+        if len(fields) != len(header):
+            continue
+        provinces.append(fields[0])
+        countries.append(fields[1])
+        lat.append(fields[2] or 'nan')
+        long.append(fields[3] or 'nan')
+        values.append(fields[4:] if positions is None else [fields[idx] for idx in positions])
+
+    return TimeSeriesTable(np.array(provinces, dtype=object), np.array(countries, dtype=object),
+                           np.array(lat, dtype=float), np.array(long, dtype=float), list(date_columns),
+                           compact_counts(_parse_counts(values, len(date_columns))))
+
+def _parse_counts(values, n_columns):
+    """Case values of rows of strings as a float matrix with n_columns columns, empty values are 0 cases."""
+    #Numbers are converted from the strings by numpy in one call
+    try:
+        counts = np.array(values, dtype=float)
+    except ValueError:
+        counts = np.array([[value or 0 for value in row] for row in values], dtype=float)
+    return counts.reshape(len(values), n_columns)
+
+# Number of lines read at once by stream_time_series_csv
+DEFAULT_STREAM_CHUNK_ROWS = 10000
+
+# Names of the location columns in the global time series files and in the US time series files
+PROVINCE_COLUMNS = ['Province/State', 'Province_State']
+COUNTRY_COLUMNS = ['Country/Region', 'Country_Region']
+LAT_COLUMNS = ['Lat']
+LONG_COLUMNS = ['Long', 'Long_']
+
+def _find_column(header, names):
+    """Position of the first of names in the header, raises ValueError if the header has none of them."""
+    for name in names:
+        if name in header:
+            return header.index(name)
+    raise ValueError('The data file has none of the columns %s' % ', '.join(names))
+
+def _open_csv_stream(url):
+    """Text stream of a CSV file from a web URL or a path, for the csv module."""
+    if url.startswith(('http://', 'https://')):
+        import urllib.request
+        return io.TextIOWrapper(urllib.request.urlopen(url), encoding='utf-8-sig', newline='')
+    return open(url, encoding='utf-8-sig', newline='')
+
+def _resolve_location_names(url, locations):
+    """ Match the names of locations to the names in a time series file the same way as Covid19Dataset.find_location.
+
+    Returns:
+        List of (name, DataLocation) tuples with the names as written in the file, raises KeyError if a name has no close match.
+
+    """
+    names = {DataLocation.province_state: {}, DataLocation.country_region: {}}
+    with _open_csv_stream(url) as stream:
+        reader = csv.reader(stream)
+        header = next(reader)
+        province_col = _find_column(header, PROVINCE_COLUMNS)
+        country_col = _find_column(header, COUNTRY_COLUMNS)
+        for fields in reader:
+            if len(fields) != len(header):
+                continue
+            if fields[province_col]:
+                names[DataLocation.province_state][fields[province_col].casefold()] = fields[province_col]
+            names[DataLocation.country_region][fields[country_col].casefold()] = fields[country_col]
+
+    resolved = []
+    for name, data_location in locations:
+        if data_location == DataLocation.world:
+            resolved.append((name, data_location))
+            continue
+        index = names[data_location]
+        key = name.casefold()
+        if key not in index:
+            close_matches = difflib.get_close_matches(key, index.keys(), n=1, cutoff=0.8)
+            if not close_matches:
+                raise KeyError('%s was not found in the COVID-19 data' % name)
+            key = close_matches[0]
+        resolved.append((index[key], data_location))
+    return resolved
+
+@timed_stage('load')
+def stream_time_series_csv(url, locations, start=None, end=None, snap=False, chunk_rows=DEFAULT_STREAM_CHUNK_ROWS):
+    """ Read only the rows of some locations and the columns of a date range from a time series file too large to load.
+
+    The file is read chunk_rows lines at a time. Lines that do not contain the name of a location are skipped without
+    parsing them, and the rows of the same province/state and country/region are summed as they are read, e.g. the
+    counties of a state in the US county files. Memory use is bounded by the selected locations, the date range and
+    the chunk size, not by the size of the file. Every row of the file must be on one line.
+
+    Parameters:
+        url
+            Web URL or path of the CSV file, in the layout of the global files (Province/State, Country/Region, Lat,
+            Long, dates) or of the US files (UID, ..., Admin2, Province_State, Country_Region, Lat, Long_, ..., dates)
+        locations
+            List of (name, DataLocation) tuples of the locations, names are matched ignoring case. The world keeps every row.
+            A name that is not in the file is matched like Covid19Dataset.find_location, e.g. 'quebek' for Quebec, the
+            file is then read again
+        start, end, snap
+            Dates of the date columns to read, same as get_date_range_indices
+
+    Returns:
+        TimeSeriesTable with one row per province/state and country/region of the selected rows, with the latitude and
+        longitude of its first row. Raises KeyError if a location has no close match in the file and ValueError for invalid dates.
+
+    """
+    keep_all = any(data_location == DataLocation.world for name, data_location in locations)
+    provinces = {name.casefold() for name, data_location in locations if data_location == DataLocation.province_state}
+    countries = {name.casefold() for name, data_location in locations if data_location == DataLocation.country_region}
+    names = provinces | countries
+
+    with _open_csv_stream(url) as stream:
+        header = next(csv.reader([stream.readline()]))
+        province_col = _find_column(header, PROVINCE_COLUMNS)
+        country_col = _find_column(header, COUNTRY_COLUMNS)
+        lat_col = _find_column(header, LAT_COLUMNS)
+        long_col = _find_column(header, LONG_COLUMNS)
+
+        #The date columns are the last columns, the US files have more location columns before them
+        first_date_col = next((col for col, column in enumerate(header) if re.match(r'^\d{1,2}/\d{1,2}/\d{2,4}$', column)), len(header))
+        if first_date_col == len(header):
+            raise ValueError('The data file has no date columns')
+        start_idx, end_idx = get_date_range_indices(parse_csv_dates(header[first_date_col:]), start, end, snap)
+        date_cols = slice(first_date_col + start_idx, first_date_col + end_idx + 1)
+
+        totals = {}
+        found = set()
+        while True:
+            lines = list(itertools.islice(stream, chunk_rows))
+            if not lines:
+                break
+            if not keep_all:
+                lines = [line for line in lines if any(name in line.casefold() for name in names)]
+
+            selected = []
+            for fields in csv.reader(lines):
+                if len(fields) != len(header):
+                    continue
+                province, country = fields[province_col].casefold(), fields[country_col].casefold()
+                if keep_all or province in provinces or country in countries:
+                    selected.append(fields)
+                    found.update((province, country))
+            if not selected:
+                continue
 
-        if data_location == DataLocation.province_state:
-            self._csv_row_data = df[df['Province/State'] == location]
+            #Only the selected date columns of the selected rows are converted to numbers
+            values = _parse_counts([fields[date_cols] for fields in selected], end_idx - start_idx + 1).astype(np.int64)
+            for fields, row_values in zip(selected, values):
+                key = (fields[province_col], fields[country_col])
+                if key in totals:
+                    totals[key][0] += row_values
+                else:
+                    totals[key] = [row_values, fields[lat_col] or 'nan', fields[long_col] or 'nan']
+
+    #Lines are only kept when they contain a name as it is given, misspelled names are matched to the names in the
+    #file in another pass over it
+    missing = [name for name, data_location in locations if data_location != DataLocation.world and name.casefold() not in found]
+    if missing:
+        resolved = _resolve_location_names(url, locations)
+        if [name.casefold() for name, data_location in resolved] == [name.casefold() for name, data_location in locations]:
+            raise KeyError('%s was not found in the COVID-19 data' % missing[0])
+        return stream_time_series_csv(url, resolved, start, end, snap, chunk_rows)
+
+    n_dates = end_idx - start_idx + 1
+    return TimeSeriesTable(np.array([key[0] for key in totals], dtype=object), np.array([key[1] for key in totals], dtype=object),
+                           np.array([total[1] for total in totals.values()], dtype=float),
+                           np.array([total[2] for total in totals.values()], dtype=float),
+                           header[date_cols], compact_counts(np.array([total[0] for total in totals.values()]).reshape(len(totals), n_dates)))
+
+def get_date_range_indices(dates, start, end, snap=False):
+    """ Get the positions of the start and end dates in a sorted datetime64[D] array of the data's dates.
+
+    Parameters:
+        dates
+            Sorted datetime64[D] array, e.g. from parse_csv_dates
+        start, end
+            Dates entered by the user in one of the DATE_FORMATS, datetime or datetime64 values, or None for the first / last date of the data.
+        snap
+            If True, dates outside the data or missing from it are moved to the nearest available date
+
+    Returns:
+        Tuple of the start and end positions, end position is inclusive. Raises ValueError for invalid dates.
+
+    """
+    start_idx = 0
+    end_idx = len(dates) - 1
+
+    for value, is_start in ((start, True), (end, False)):
+        if value is None:
+            continue
+        date = parse_date(value)
+        pos = None if date is None else find_date_position(dates, date, snap)
+        if pos is None:
+            raise ValueError('The value %s, is an invalid %s date' %(value, 'start' if is_start else 'end'))
+        if is_start:
+            start_idx = pos
+        else:
+            end_idx = pos
+
+    if start_idx > end_idx:
+        raise ValueError('The start date %s is after the end date %s' %(dates[start_idx], dates[end_idx]))
+
+    return (start_idx, end_idx)
+
+def log_cases(values):
+    """Natural log of case values. Zero or negative values are kept as they are, same as the single location plot."""
+    values = np.asarray(values, dtype=float)
+    positive = values > 0
+    return np.where(positive, np.log(np.where(positive, values, 1.0)), values)
+
+# Policies of clean_cases for the flagged days
+QUALITY_POLICIES = ['none', 'drop', 'clip', 'interpolate']
+
+# Days flagged and changed by clean_cases, boolean matrices with one row per location and one column per day
+QualityReport = collections.namedtuple('QualityReport', ['revisions', 'zeros', 'spikes', 'changed'])
+
+def find_quality_issues(values):
+    """ Flag the days of cumulative case values that bias the log-linear fit, for every location at once.
+
+    Parameters:
+        values
+            Case values, 1-D for one location or 2-D with one row per location
+
+    Returns:
+        Boolean matrices of the downward revisions (days below a value reported before), the days with zero or negative
+        cases (their log is undefined) and the one-day spikes (days above the days before and after, when the day after
+        is back on the trend)
+
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    previous, current, following = values[:, :-2], values[:, 1:-1], values[:, 2:]
+
+    spikes = np.zeros(values.shape, dtype=bool)
+    spikes[:, 1:-1] = (current > previous) & (current > following) & (following >= previous)
+
+    #Spikes are left out of the running maximum, so the day after a spike is not a revision
+    without_spikes = values.copy()
+    without_spikes[:, 1:-1] = np.where(spikes[:, 1:-1], previous, current)
+    revisions = without_spikes < np.maximum.accumulate(without_spikes, axis=1)
+
+    return revisions, values <= 0, spikes
+
+@timed_stage('quality')
+def clean_cases(values, policy='interpolate'):
+    """ Data quality pass over the case values of many locations, between get_covid19_data and the fit.
+
+    Parameters:
+        values
+            Case values, 1-D for one location or 2-D with one row per location
+        policy
+            What is done with the days flagged by find_quality_issues:
+            none leaves the values as they are and only reports the flagged days,
+            drop leaves the flagged days out of the fit,
+            clip raises the revisions to the highest value reported before and lowers the spikes to the day before,
+            interpolate replaces the flagged days by interpolating the log of the values between the nearest good days.
+            Except with none, days with zero or negative cases and days that cannot be interpolated are dropped.
+
+    Returns:
+        Float matrix of the cleaned values with NaN for the dropped days (the fit leaves them out), and the QualityReport
+
+    """
+    if policy not in QUALITY_POLICIES:
+        raise ValueError('Unknown data quality policy %s, use one of %s' %(policy, ', '.join(QUALITY_POLICIES)))
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    revisions, zeros, spikes = find_quality_issues(values)
+    flagged = revisions | zeros | spikes
+
+    if policy == 'none':
+        cleaned = values.copy()
+    elif policy == 'drop':
+        cleaned = np.where(flagged, np.nan, values)
+    elif policy == 'clip':
+        without_spikes = values.copy()
+        without_spikes[:, 1:] = np.where(spikes[:, 1:], values[:, :-1], values[:, 1:])
+        cleaned = np.where(zeros, np.nan, np.maximum.accumulate(without_spikes, axis=1))
+    else:
+        #Position of the nearest good day before and after every day, n_days when there is none after
+        n_days = values.shape[1]
+        good = ~flagged
+        days = np.arange(n_days)
+        before = np.maximum.accumulate(np.where(good, days, -1), axis=1)
+        after = np.minimum.accumulate(np.where(good, days, n_days)[:, ::-1], axis=1)[:, ::-1]
+
+        ln_values = np.log(np.where(good, values, 1.0))
+        ln_before = np.take_along_axis(ln_values, np.clip(before, 0, n_days - 1), axis=1)
+        ln_after = np.take_along_axis(ln_values, np.clip(after, 0, n_days - 1), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(after > before, (days - before) / (after - before), 0.0)
+        interpolated = np.where((before >= 0) & (after < n_days), np.exp(ln_before + fraction * (ln_after - ln_before)), np.nan)
+        cleaned = np.where(good, values, interpolated)
+
+    #Dropped days are NaN and never equal to the values
+    return cleaned, QualityReport(revisions, zeros, spikes, ~(cleaned == values))
+
+def describe_quality_report(report, date_columns, policy, row=0):
+    """Readable summary of one row of a QualityReport, date_columns are the dates of its days."""
+    def days(flags):
+        dates = [get_readable_date(date_columns[day]) for day in np.flatnonzero(flags[row])]
+        return '%d%s' %(len(dates), ' (%s)' % ', '.join(dates) if 0 < len(dates) <= 10 else '')
+    return 'Data quality (%s): downward revisions %s, days with zero cases %s, one-day spikes %s, days changed %s' \
+        %(policy, days(report.revisions), days(report.zeros), days(report.spikes), days(report.changed))
+
+def fit_log_linear(x, ln_y):
+    """ Closed-form least squares fit of ln_y = slope * x + intercept for many locations at once.
+
+    Parameters:
+        x
+            1-D array of the day numbers, e.g. 1, 2, 3, ...
+        ln_y
+            Natural log of the case values, 1-D for one location or 2-D with one row per location.
+
+    Returns:
+        FitResult with slope, intercept, R squared, doubling time and daily R0 arrays (one value per row of ln_y)
+
+    """
+    fit = fit_statistics(x, ln_y)
+    return FitResult(fit.slope, fit.intercept, fit.r_squared, fit.doubling_time, fit.r0)
+
+def rolling_fit(ln_y, window, step=1):
+    """ Fit the log-linear model over every window of window days, for one or many locations.
+
+    The sums of x, y, x*y, x^2 and y^2 of every window come from cumulative sums, so all windows are fitted in O(n).
+    Within each window the days are numbered 1, 2, 3, ... as in the single location plot.
+
+    Parameters:
+        ln_y
+            Natural log of the case values, 1-D for one location or 2-D with one row per location.
+        window
+            Number of days in each window, at least 2
+        step
+            Number of days between the starts of two windows
+
+    Returns:
+        Array of the start position of each window and a FitResult with one column per window
+
+    """
+    ln_y = np.atleast_2d(np.asarray(ln_y, dtype=float))
+    n_days = ln_y.shape[1]
+    if window < 2 or window > n_days:
+        raise ValueError('The window of %d days must be between 2 and the %d days of data' %(window, n_days))
+    if step < 1:
+        raise ValueError('The window step must be at least 1 day')
+
+    starts = np.arange(0, n_days - window + 1, step)
+
+    #Shift every location to start at 0 so the cumulative sums stay small and precise, the intercept is shifted back
+    offset = ln_y[:, :1]
+    ln_y = ln_y - offset
+
+    def cumulative_sums(values):
+        cumulative = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+        np.cumsum(values, axis=-1, out=cumulative[..., 1:])
+        return cumulative
+
+    def window_sums(cumulative):
+        return cumulative[..., starts + window] - cumulative[..., starts]
+
+    x = np.arange(n_days, dtype=float)
+    sum_x = window_sums(cumulative_sums(x))
+    sum_xx = window_sums(cumulative_sums(x * x))
+    sum_y = window_sums(cumulative_sums(ln_y))
+    cumulative_yy = cumulative_sums(ln_y * ln_y)
+    sum_yy = window_sums(cumulative_yy)
+    sum_xy = window_sums(cumulative_sums(ln_y * x))
+
+    cov_xy = sum_xy - sum_x * sum_y / window
+    var_x = sum_xx - sum_x * sum_x / window
+    var_y = sum_yy - sum_y * sum_y / window
+
+    #A window is flat when none of its day-to-day differences is non-zero, counted with a cumulative sum too
+    changes = np.zeros(ln_y.shape[:-1] + (n_days,))
+    np.cumsum(np.diff(ln_y, axis=-1) != 0, axis=-1, out=changes[..., 1:])
+    flat = changes[..., starts + window - 1] == changes[..., starts]
+
+    #The variance of nearly flat windows is lost in the rounding errors of the cumulative sums, these few windows
+    #are computed again from their values centered on their means
+    nearly_flat = ~flat & (var_y <= 1e-6 * cumulative_yy[..., starts + window])
+    if nearly_flat.any():
+        rows, columns = np.nonzero(nearly_flat)
+        positions = starts[columns][:, np.newaxis] + np.arange(window)
+        y_dev = ln_y[rows[:, np.newaxis], positions]
+        y_dev = y_dev - y_dev.mean(axis=1, keepdims=True)
+        x_dev = np.arange(window) - (window - 1) / 2
+        var_y[nearly_flat] = np.einsum('ij,ij->i', y_dev, y_dev)
+        cov_xy[nearly_flat] = y_dev.dot(x_dev)
+
+    fit = _fit_from_moments(sum_x / window, sum_y / window, var_x, var_y, cov_xy, flat)
+
+    #Day 1 is the first day of each window, the intercept is moved there and shifted back
+    intercept = offset + fit.intercept + fit.slope * (starts - 1)
+
+    return starts, fit._replace(intercept=intercept)
+
+def log_linear_sums(x, ln_y):
+    """ Running sums of the log-linear fit for each location: n, sum of x, x^2, y, y^2 and x*y.
+
+    Sums of consecutive days can be added together, see fit_from_sums.
+
+    Returns:
+        Array with one row of the 6 sums per row of ln_y
+
+    """
+    x = np.asarray(x, dtype=float)
+    ln_y = np.atleast_2d(np.asarray(ln_y, dtype=float))
+    n = np.full(ln_y.shape[0], float(x.size))
+    return np.column_stack([n, np.full_like(n, x.sum()), np.full_like(n, x.dot(x)),
+                            ln_y.sum(axis=1), np.einsum('ij,ij->i', ln_y, ln_y), ln_y.dot(x)])
+
+def fit_from_sums(n, sum_x, sum_xx, sum_y, sum_yy, sum_xy, flat=None):
+    """ Least squares fit of the log-linear model from the sums of x, x^2, y, y^2 and x*y over n days.
+
+    Gives the same statistics as fit_log_linear with the intercept at x = 0, R squared is undefined when y is flat.
+
+    Parameters:
+        flat
+            Optional boolean array, True where all the y values are equal. The sums cannot tell a flat series from a
+            nearly flat one, so flat series are given by the caller, e.g. from the differences of the values
+
+    Returns:
+        FitResult with one value per element of the sums
+
+    """
+    cov_xy = sum_xy - sum_x * sum_y / n
+    var_x = sum_xx - sum_x * sum_x / n
+    var_y = sum_yy - sum_y * sum_y / n
+    return _fit_from_moments(sum_x / n, sum_y / n, var_x, var_y, cov_xy, flat)
+
+def _fit_from_moments(mean_x, mean_y, var_x, var_y, cov_xy, flat=None):
+    """Fit of fit_from_sums from the means, the sums of squared deviations of x and y and the sum of their cross products."""
+    #A flat series has no variance, rounding errors of the sums are removed so its slope is 0 and R squared is undefined like in coeff_determination
+    if flat is not None:
+        var_y = np.where(flat, 0.0, var_y)
+        cov_xy = np.where(flat, 0.0, cov_xy)
+
+    slope = cov_xy / var_x
+    intercept = mean_y - slope * mean_x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = 1 - (var_y - slope * cov_xy) / var_y
+        doubling_time = np.log(2.) / slope
 
-        #Get country data
-        elif data_location == DataLocation.country_region:
-            self._csv_row_data = df[df['Country/Region'] == location].groupby('Country/Region').sum()
-            
-        #World data
-        elif data_location == DataLocation.world:
+    return FitResult(slope, intercept, r_squared, doubling_time, np.exp(slope) - 1)
 
-            #Add a row at the bottom that has total global value 
-            df = df.append(df.sum(numeric_only=True), ignore_index=True)
+# Plot data of a location returned by Covid19Data.get_covid19_data
+Covid19PlotData = collections.namedtuple('covid19_data', ['x01_plot_data', 'y01_plot_data', 'start_date_col', 'end_date_col'])
 
-            self.world_row_index = df.shape[0]-1
-            self._csv_row_data = df
-        
-        # Remove the zero padding from single digit date values so it matches JHU data. e.g. Feb. 9 2020 is shown as 2/9/20 in the csv data.
-        if platform.system() == 'Windows':
-            self._csv_date_format = '%#m/%#d/%y'
-            print('Using Python date format for Windows')
-        elif platform.system() == 'Darwin' or platform.system() == 'Linux':
-            self._csv_date_format = '%-m/%-d/%y'
-            print('Using Python date format for MacOS / Linux')
+class Covid19Data:
+
+    def __init__(self, location, url, data_location, cache=None, dataset=None):
+        """Constructor
+
+        A loaded Covid19Dataset can be passed in so many locations are looked up from its index without reading the file again.
+        The url can also be a directory written by Covid19Dataset.export, which is opened memory-mapped.
+        """
+        self._url = url
+        self._data_location = data_location
+
+        if dataset is None:
+            dataset = Covid19Dataset(url, cache)
+        self._dataset = dataset
+
+        #Look up the location's case values in the dataset index, a row of the dataset and not a copy
+        self._location, self._values = dataset.find_location(location, data_location)
+        self._dates = dataset.dates
+        self._csv_row_data = None
 
     @property
     def location(self):
@@ -75,342 +766,1717 @@ class Covid19Data:
     def url(self):
         return self._url
 
+    @property
+    def dataset(self):
+        return self._dataset
+
+    @property
+    def values(self):
+        return self._values
+
     @property 
     def csv_row_data(self):
-       return self._csv_row_data
+        """One row data frame of the location in the layout of the CSV file, built when first used."""
+        if self._csv_row_data is None:
+            self._csv_row_data = self._dataset.get_location_frame(self._location, self._data_location)[1]
+        return self._csv_row_data
     
     @property
     def csv_date_format(self):
-        return self._csv_date_format
+        return CSV_DATE_FORMAT
+
+    @property
+    def dates(self):
+        return self._dates
 
     # Calculate Coefficient of Determination / r-squared. This function is based on Valeriu Predoi's code https://github.com/valeriupredoi/COVID-19_LINEAR
     def coeff_determination(self, ys_orig, ys_line):
         """Compute the line R squared."""
-        y_mean_line = [np.mean(ys_orig) for y in ys_orig]
-        squared_error_regr = sum((ys_line - ys_orig) * (ys_line - ys_orig))
-        squared_error_y_mean = sum((y_mean_line - ys_orig) * \
-                                   (y_mean_line - ys_orig))
-        return 1 - (squared_error_regr / squared_error_y_mean)
-
-    def set_start_end_dates(self, start, end):
-        
-        start_date = None
-        end_date = None
-        start_end_indices = None
-        
-        #Allow date in format of mm/dd/YYYY or mm/dd/yy feb/29/20 or feb/29/2020 etc.
-        formats=['%m/%d/%Y', '%m/%d/%y', '%b/%d/%y', '%b/%d/%Y', '%B/%d/%Y', '%m-%d-%Y', '%m-%d-%y', '%b-%d-%y', '%b-%d-%Y', '%B-%d-%Y']
-
-        for fmt in formats:
-            try:
-                start_date = datetime.datetime.strptime(start, fmt)
-            except:
-                continue
-
-        #Try to parse end date separately as it could be different date format than start date.
-        for fmt in formats:
-            try:
-                end_date = datetime.datetime.strptime(end, fmt)
-            except:
-                continue
-
-
-
-        if start_date is not None and end_date is None:
-
-            start_date_col = start_date.strftime(self.csv_date_format)
-          
-            try:
-                print(list(self.csv_row_data).index(start_date_col))
-                csv_start_idx = list(self.csv_row_data).index(start_date_col)
+        ys_orig = np.asarray(ys_orig, dtype=float)
+        regr_error = ys_line - ys_orig
+        y_mean_error = ys_orig.mean() - ys_orig
+        return 1 - (regr_error.dot(regr_error) / y_mean_error.dot(y_mean_error))
 
-                print(self.csv_row_data)
-                return (csv_start_idx, None)
-            except ValueError as e:
-                print ('The value %s, is an invalid start date' %(e))
+    @timed_stage('dates')
+    def set_start_end_dates(self, start, end, snap=False):
+        """ Find the date columns of the start and end dates.
 
-        elif start_date is not None and end_date is not None:
+        Parameters:
+            start, end
+                Dates in one of the DATE_FORMATS, or None if not provided
+            snap
+                If True, dates outside the data or missing from it are moved to the nearest available date
 
-            start_date_col = start_date.strftime(self.csv_date_format)
+        Returns:
+            Tuple of the start date column index and end date column index, None for a date that is not provided.
+            Returns None if a date is not in the data.
 
-            try:
-                csv_start_idx = list(self.csv_row_data).index(start_date_col)
+        """
+        start_end_indices = []
 
-                end_date_col = end_date.strftime(self.csv_date_format)
-                csv_end_idx = list(self.csv_row_data).index(end_date_col)
-                return (csv_start_idx, csv_end_idx)
-            except ValueError as e:
-                print ('There was an error with one the dates entered: %s' %(e))
+        #Start date and end date are parsed separately as they could be in different date formats
+        for value, label in ((start, 'start'), (end, 'end')):
+            date = parse_date(value)
+            if date is None:
+                start_end_indices.append(None)
+                continue
 
-        elif start_date is None and end_date is not None:
+            pos = find_date_position(self._dates, date, snap)
+            if pos is None:
+                print('The value %s, is an invalid %s date' %(value, label))
+                return None
+            start_end_indices.append(pos)
 
-            end_date_col = end_date.strftime(self.csv_date_format)
-            try:
-                csv_end_idx = list(self.csv_row_data).index(end_date_col)
-                return (None, csv_end_idx)
-            except ValueError as e:
-                print ('The value %s, is an invalid end date' %(e))
-
-        # User did not provide start date nor end date for plotting.
-        else:
-            return (None, None)
+        return tuple(start_end_indices)
 
     # Returns readable date, e.g. Mar/31/2020 instead of 03/31/20
     def get_readable_date(self, csv_date):
-        try:
-            date_label = datetime.datetime.strptime(csv_date, '%m/%d/%y')
-            return datetime.datetime.strftime(date_label, '%b/%d/%Y') 
-        except:
-            return 'Invalid Date'
+        return get_readable_date(csv_date)
 
     # Get the csv data based on start and end dates, to use for plotting
+    @timed_stage('slice')
     def get_covid19_data(self, start_end_dates):
         """ Get the covid19 data for Y and x axes and start dates.
 
         Parameters:
             start_end_dates
-                Tuple containing column index of start date and column index of end date.
+                Tuple containing date column index of start date and date column index of end date.
         
         Returns:
-            X axis data of the dates, Y axis data of the case numbers, and start date column and end date column
+            X axis data of the dates, Y axis data of the case numbers (a slice of the dataset, not a copy),
+            and start date column and end date column
                 
         """
-        start_idx = None
-        end_idx = None
+        # Checks if start date and end date are provided. Start date is optional, and End date is also optional.
+        #No start date given, but start date of dataset still needs to be defined at Jan. 22, 2020
+        start_idx = start_end_dates[0] if start_end_dates[0] is not None else 0
+        end_idx = start_end_dates[1]
 
-        covid19_data = collections.namedtuple('covid19_data',['x01_plot_data', 'y01_plot_data', 'start_date_col', 'end_date_col']) 
+        y01_plot_data = self._values[start_idx:] if end_idx is None else self._values[start_idx:end_idx+1]
 
-        # Checks if start date and end date are provided. Start date is optional, and End date is also optional.
-        if start_end_dates[0] is not None:
-            start_idx = start_end_dates[0]
-
-        if start_end_dates[1] is not None:
-            end_idx = start_end_dates[1]
-
-        if start_idx is not None and end_idx is None and self.data_location == DataLocation.world:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[self.world_row_index, start_idx:]
-
-        elif start_idx is not None and end_idx is not None and self.data_location == DataLocation.world:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[self.world_row_index, start_idx:end_idx+1]
-
-        #works for prov/state or country/region
-        elif start_idx is not None and end_idx is None:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0, start_idx:]
-
-        #works for prov/state or country/region
-        elif start_idx is not None and end_idx is not None:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0, start_idx:end_idx+1]
-
-        elif start_idx is None and end_idx is not None and self.data_location == DataLocation.province_state:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0,4:end_idx+1]
-            start_idx = 4
-
-        elif start_idx is None and end_idx is not None and self.data_location == DataLocation.country_region:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0,2:end_idx+1]
-            start_idx = 2
-            
-        elif start_idx is None and end_idx is not None and self.data_location == DataLocation.world:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[self.world_row_index,4:end_idx+1]
-            start_idx = 4   
-
-        #No start date and end dates given, but start date of dataset still needs to be defined at Jan. 22, 2020           
-        elif start_idx is None and end_idx is None and self.data_location == DataLocation.province_state:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0,4:]
-            start_idx = 4
-
-        elif start_idx is None and end_idx is None and self.data_location == DataLocation.country_region:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[0,2:]
-            start_idx = 2
-        
-        elif start_idx is None and end_idx is None and self.data_location == DataLocation.world:
-            covid19_data.y01_plot_data = self.csv_row_data.iloc[self.world_row_index,4:]
-            start_idx = 4  
-            
         #This provides the days on the X axis, e.g. Day 1, 2, 3, 4, 5, etc.
-        covid19_data.x01_plot_data = [np.float(x) for x in range(1, len(covid19_data.y01_plot_data)+1)]
+        x01_plot_data = np.arange(1, len(y01_plot_data)+1, dtype=float)
 
-        covid19_data.start_date_col = start_idx
-        covid19_data.end_date_col = end_idx
+        return Covid19PlotData(x01_plot_data, y01_plot_data, start_idx, end_idx)
+
+    def clean(self, covid19_data, policy='interpolate'):
+        """ Data quality pass over the data of get_covid19_data before the fit, see clean_cases.
+
+        Returns:
+            Covid19PlotData with the cleaned case values (NaN for dropped days) and the QualityReport of its one row
+
+        """
+        cleaned, report = clean_cases(covid19_data.y01_plot_data, policy)
+        return covid19_data._replace(y01_plot_data=cleaned[0]), report
 
-        return covid19_data
+    def get_quality_description(self, covid19_data, report, policy):
+        """Readable summary of the QualityReport of clean."""
+        return describe_quality_report(report, self._dataset.date_columns[covid19_data.start_date_col:], policy)
+
+    def get_date_label(self, date_col):
+        """Readable date of a date column index, the last date if None."""
+        return get_readable_date(self._dataset.date_columns[-1 if date_col is None else date_col])
 
 
     #returns double image data for rendering to segmented red, orange, yellow to show the intensity of the virus' doubling time
     #Returns a list of red orange yellow proportions
     def get_doubling_time_cmap(self, doubling_time):
-        
-        if doubling_time <= 60:
-            return [(0.0, '#FF0000'), (0.5, '#FFA500'), (1.0, '#FFFF00')]
-
-        #Show more yellows to indicate less danger
-        elif doubling_time > 60 and doubling_time <= 365:
-            return [(0.0, '#FF0000'), (0.35, '#FFA500'), (0.75, '#FFFF00'), (1.0, '#FFFF80')]
+        return DOUBLING_TIME_COLORS[get_doubling_time_color_level(doubling_time)]
 
-        #Show mostly yellows as doubling time is more than a year
-        elif doubling_time > 365:
-            return [(0.0, '#FF0000'), (0.1, '#FFA500'), (0.4, '#FFFF00'), (1.0, '#FFFF80')]
-            #return colors.LinearSegmentedColormap.from_list('custom roy', [(0.0, '#FF0000'), (0.2, '#FFA500'), (0.6, '#FFFF00')], N=256)
+    @timed_stage('fit')
+    def fit(self, covid19_data):
+        """ Fit the log-linear model to the data of get_covid19_data.
 
-    def plot(self, covid19_data):
-
-        # Plot data, using some of Valeriu Predoi's statistical calcuations and plotting code from https://github.com/valeriupredoi/COVID-19_LINEAR
+        Returns:
+            Natural log of the case values, the fitted line values and the FitResult of the fit. With fewer than 2 days
+            left by clean, the fitted line and the FitResult are NaN
 
-        # ln_y1 is the natural log of y01_plot_data. y01_plot_data contains daily case values
-        ln_y1 = np.asarray([y if int(y)<=0  else np.log(y) for y in covid19_data.y01_plot_data])
+        """
+        # Statistical calcuations from Valeriu Predoi's code https://github.com/valeriupredoi/COVID-19_LINEAR
 
-        print('Abbreviated output of Covid-19 Infection Values')
-        print(covid19_data.y01_plot_data)
-        print('Natural Log of Covid-19 Infection values')
-        print(ln_y1)
+        # ln_y1 is the natural log of y01_plot_data. y01_plot_data contains daily case values, days dropped by clean are NaN
+        ln_y1 = log_cases(covid19_data.y01_plot_data)
+        valid = np.isfinite(ln_y1)
+        if np.count_nonzero(valid) < 2:
+            return ln_y1, np.full_like(ln_y1, np.nan), FitResult(*([np.nan] * len(FitResult._fields)))
 
-        coef = np.polyfit(covid19_data.x01_plot_data, ln_y1, 1)
+        coef = np.polyfit(covid19_data.x01_plot_data[valid], ln_y1[valid], 1)
         poly1d_fn1 = np.poly1d(coef)
+        fit_line = poly1d_fn1(covid19_data.x01_plot_data)
 
         # statistical parameters first line 
-        R = self.coeff_determination(ln_y1, poly1d_fn1(covid19_data.x01_plot_data))  # R squared
-        y_error = poly1d_fn1(covid19_data.x01_plot_data) - ln_y1  # error
+        R = self.coeff_determination(ln_y1[valid], fit_line[valid])  # R squared
         
         slope = coef[0]  # slope
         d_time = np.log(2.) / slope  # doubling time
         R0 = np.exp(slope) - 1 #daily reproductive number
 
+        return ln_y1, fit_line, FitResult(slope, coef[1], R, d_time, R0)
+
+    @timed_stage('fit')
+    def fit_intervals(self, covid19_data, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE):
+        """ Standard error of the slope and bootstrap confidence intervals of the slope, doubling time and R0.
+
+        Returns:
+            FitStatistics and ConfidenceIntervals of the location, see covid19_statistics.bootstrap_intervals
+
+        """
+        ln_y = log_cases(covid19_data.y01_plot_data)
+        fit, intervals = bootstrap_intervals(covid19_data.x01_plot_data, ln_y, resamples, confidence)
+        return fit._make(value[0] for value in fit), intervals._make(value[0] for value in intervals)
+
+    def print_intervals(self, covid19_data, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE):
+        """Print the standard error of the slope and the confidence intervals of fit_intervals."""
+        fit, intervals = self.fit_intervals(covid19_data, resamples, confidence)
+        print('Slope standard error %.4f' %fit.slope_stderr)
+        print('Slope %d%% confidence interval %.3f to %.3f' %(round(confidence * 100), intervals.slope_low, intervals.slope_high))
+        print('Doubling time %d%% confidence interval %.2f to %.2f' %(round(confidence * 100), intervals.doubling_time_low, intervals.doubling_time_high))
+        print('R0 %d%% confidence interval %.2f to %.2f' %(round(confidence * 100), intervals.r0_low, intervals.r0_high))
+
+    def print_stats(self, covid19_data, as_json=False, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE):
+        """Print the slope, R squared, doubling time and R0 of the fit without plotting, as text or as one line of JSON.
+
+        With resamples, the standard error of the slope and the confidence intervals are printed too, 0 leaves them out.
+        """
+        fit = self.fit(covid19_data)[2]
+        if as_json:
+            stats = fit._asdict()
+            if resamples:
+                fit_stats, intervals = self.fit_intervals(covid19_data, resamples, confidence)
+                stats.update(slope_stderr=fit_stats.slope_stderr, confidence=confidence, **intervals._asdict())
+
+            #Doubling time of a flat curve is infinite, not finite values are written as null
+            stats = {field: (float(value) if np.isfinite(value) else None) for field, value in stats.items()}
+            print(json.dumps(dict(location=self.location, data_location=self.data_location.name,
+                                  start_date=self._dataset.date_columns[covid19_data.start_date_col],
+                                  end_date=self._dataset.date_columns[covid19_data.start_date_col+len(covid19_data.y01_plot_data)-1], **stats)))
+            return
+
+        print('Slope value %.3f' %fit.slope)
+        print('R Squared Value %.3f' %fit.r_squared)
+        print('Doubling time %.2f' %fit.doubling_time)
+        print('R0 Value %.2f' %fit.r0)
+        if resamples:
+            self.print_intervals(covid19_data, resamples, confidence)
+
+    def plot(self, covid19_data, output_path=None, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE):
+
+        # Plot data, using some of Valeriu Predoi's statistical calcuations and plotting code from https://github.com/valeriupredoi/COVID-19_LINEAR
+        ln_y1, fit_line, fit = self.fit(covid19_data)
+        slope, R, d_time, R0 = fit.slope, fit.r_squared, fit.doubling_time, fit.r0
+
+        import pandas as pd
+
+        print('Abbreviated output of Covid-19 Infection Values')
+        date_columns = self._dataset.date_columns[covid19_data.start_date_col:covid19_data.start_date_col+len(covid19_data.y01_plot_data)]
+        print(pd.Series(covid19_data.y01_plot_data, index=date_columns))
+        print('Natural Log of Covid-19 Infection values')
+        print(ln_y1)
+
         print('Slope value %.3f' %slope)
         print('R Squared Value %.3f' %R)
         print('Doubling time %.2f' %d_time)
         print('R0 Value %.2f' %R0)
+        if resamples:
+            self.print_intervals(covid19_data, resamples, confidence)
 
-        if covid19_data.start_date_col is None:
-            start_date_label = self.get_readable_date(self.csv_row_data.columns[4])
-        else:
-            start_date_label = self.get_readable_date(self.csv_row_data.columns[covid19_data.start_date_col])
+        start_date_label = self.get_date_label(covid19_data.start_date_col)
+        end_date_label = self.get_date_label(covid19_data.end_date_col)
 
-        if covid19_data.end_date_col is None:
-            end_date_label = self.get_readable_date(self.csv_row_data.columns[-1])
+        #Headless rendering when saving to a file, otherwise shown in a window
+        if output_path is not None:
+            renderer = Covid19PlotRenderer()
         else:
-            end_date_label = self.get_readable_date(self.csv_row_data.columns[covid19_data.end_date_col])
+            import matplotlib.pyplot as plt
+            renderer = Covid19PlotRenderer(plt.figure(figsize=(10,10)))
 
+        renderer.draw(self.location, covid19_data.x01_plot_data, covid19_data.y01_plot_data, ln_y1, fit_line,
+                      slope, R, R0, d_time, start_date_label, end_date_label)
 
-        gridsize = (2, 2)
-        fig = plt.figure(figsize=(10,10)) #width and height
-        ax1 = plt.subplot2grid(gridsize, (0, 0), colspan=1, rowspan=3)
-        ax2 = plt.subplot2grid(gridsize, (0, 1))
-        ax3 = plt.subplot2grid(gridsize, (1, 1))
-        
-        
-
-        # List Integer values to use build the plotted colou map images
-        IMAGE_ROW_VALUES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 130, 140, 150, 160, 170, 180, 190]
-
-        # Build the linear plot
-        ax1.plot(covid19_data.x01_plot_data, ln_y1, 'yo', covid19_data.x01_plot_data, poly1d_fn1(covid19_data.x01_plot_data), '--r', label=self.location)
-        ax1.errorbar(covid19_data.x01_plot_data, ln_y1, yerr=y_error, fmt='o', color='r')
+        if output_path is not None:
+            renderer.save(output_path)
+        else:
+            plt.show()
+
+
+# Data and fit of one location returned by fit_location
+LocationFit = collections.namedtuple('LocationFit', ['name', 'x', 'y', 'ln_y', 'fit', 'start_date', 'end_date'])
+
+def fit_location(dataset, location, data_location, start_idx, end_idx):
+    """ Fit the log-linear model of one location of a Covid19Dataset.
+
+    Parameters:
+        location, data_location
+            Name and DataLocation type of the location
+        start_idx, end_idx
+            Positions of the start and end dates, e.g. from Covid19Dataset.get_date_indices
+
+    Returns:
+        LocationFit with the name as written in the data, the days, case values, their natural log,
+        the FitResult (single values) and the start and end date columns
+
+    """
+    name, values = dataset.find_location(location, data_location)
+    y = np.asarray(values[start_idx:end_idx+1])
+    x = np.arange(1, len(y)+1, dtype=float)
+    ln_y = log_cases(y)
+    with stage_timer('fit'):
+        fit = FitResult(*(value[0] for value in fit_log_linear(x, ln_y)))
+    return LocationFit(name, x, y, ln_y, fit, dataset.date_columns[start_idx], dataset.date_columns[end_idx])
+
+def fit_locations(dataset, locations, start_idx, end_idx, quality=None):
+    """ Fit the log-linear model of many locations of a Covid19Dataset in one vectorized pass.
+
+    Parameters:
+        locations
+            List of (name, DataLocation) tuples of the locations
+        start_idx, end_idx
+            Positions of the start and end dates, e.g. from Covid19Dataset.get_date_indices
+        quality
+            Policy of the data quality pass before the fit, see clean_cases. None skips the pass
+
+    Returns:
+        List of LocationFit, one per location in the same order, and the QualityReport of the locations (None without quality)
+
+    """
+    found = [dataset.find_location(location, data_location) for location, data_location in locations]
+    y = np.vstack([np.asarray(values[start_idx:end_idx+1]) for name, values in found])
+    report = None
+    if quality is not None:
+        y, report = clean_cases(y, quality)
+    x = np.arange(1, y.shape[1]+1, dtype=float)
+    ln_y = log_cases(y)
+    with stage_timer('fit'):
+        fit = fit_log_linear(x, ln_y)
+    return [LocationFit(name, x, y[row], ln_y[row], FitResult(*(value[row] for value in fit)),
+                        dataset.date_columns[start_idx], dataset.date_columns[end_idx]) for row, (name, values) in enumerate(found)], report
+
+def get_location_fit_stats(location_fit, data_location):
+    """Dict of the name, dates and fit statistics of a LocationFit for JSON output, not finite values are None."""
+    fit = {field: (float(value) if np.isfinite(value) else None) for field, value in location_fit.fit._asdict().items()}
+    return dict(location=location_fit.name, data_location=data_location.name, start_date=location_fit.start_date,
+                end_date=location_fit.end_date, **fit)
+
+def draw_location_fit(renderer, location_fit):
+    """Draw a LocationFit with a Covid19PlotRenderer."""
+    x, fit = location_fit.x, location_fit.fit
+    renderer.draw(location_fit.name, x, location_fit.y, location_fit.ln_y, fit.slope * x + fit.intercept, fit.slope,
+                  fit.r_squared, fit.r0, fit.doubling_time, get_readable_date(location_fit.start_date), get_readable_date(location_fit.end_date))
+
+# Colour proportions of the doubling time chart, more yellows are shown for slower doubling times
+DOUBLING_TIME_COLORS = [
+    [(0.0, '#FF0000'), (0.5, '#FFA500'), (1.0, '#FFFF00')],
+    #Show more yellows to indicate less danger
+    [(0.0, '#FF0000'), (0.35, '#FFA500'), (0.75, '#FFFF00'), (1.0, '#FFFF80')],
+    #Show mostly yellows as doubling time is more than a year
+    [(0.0, '#FF0000'), (0.1, '#FFA500'), (0.4, '#FFFF00'), (1.0, '#FFFF80')],
+]
+
+# List Integer values to use build the plotted colou map images
+IMAGE_ROW_VALUES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 130, 140, 150, 160, 170, 180, 190]
+
+def get_doubling_time_color_level(doubling_time):
+    """Index in DOUBLING_TIME_COLORS for a doubling time: up to 60 days, up to a year, or more than a year."""
+    if doubling_time <= 60:
+        return 0
+    elif doubling_time <= 365:
+        return 1
+    return 2
+
+def get_slope_scale_offset(slope):
+    """Position of the slope arrow on the slope chart, in axes fraction."""
+    #Very steep rise in infections
+    if slope > 0.12:
+        return 0.85
+    #Steep curve
+    elif slope > 0.09:
+        return 0.7
+    #Curve is a bit steep
+    elif slope > 0.05:
+        return 0.55
+    #Most countries are here and flattening their infection rates
+    elif slope >= 0.009:
+        return 0.38
+    #Very flat curve
+    elif slope > 0:
+        return 0.14
+    #Downward revision of cases
+    return 0
+
+def get_doubling_time_positions(d_time):
+    """Positions of the doubling time arrow, the 60 days arrow and the 60 days label on the doubling time chart, in axes fraction."""
+    if d_time > 60:
+        return 1.0, 60/d_time, 60/d_time
+    elif d_time > 0:
+        #Allow for small offset from right boundary of axis.
+        return d_time/60, 1.0, 0.80
+    return -0.08, 1.0, 0.80
+
+class Covid19PlotRenderer:
+    """The linear plot with the slope and doubling time charts, built once and reused for many locations.
+
+    The axes, colour maps, colour scale images and annotations are created in the constructor, draw only
+    updates the data, labels and arrow positions. Without a figure the renderer draws headless with Agg.
+    """
+
+    @timed_stage('render')
+    def __init__(self, figure=None):
+        """Constructor"""
+        #matplotlib is only imported when rendering, stats-only runs start faster without it
+        from matplotlib import colors
+        from matplotlib.collections import LineCollection
+        if figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            figure = Figure(figsize=(10,10)) #width and height
+            FigureCanvasAgg(figure)
+        self._figure = figure
+
+        grid = figure.add_gridspec(2, 2)
+        ax1 = figure.add_subplot(grid[:, 0])
+        ax2 = figure.add_subplot(grid[0, 1])
+        ax3 = figure.add_subplot(grid[1, 1])
+        self._axes = (ax1, ax2, ax3)
+
+        # Linear plot, the yellow points are drawn under the red points with error bars
+        self._points, self._fit_line = ax1.plot([], [], 'yo', [], [], '--r')
+        self._error_lines = LineCollection([], colors='r')
+        ax1.add_collection(self._error_lines)
+        self._error_points, = ax1.plot([], [], 'o', color='r')
         ax1.grid()
-        ax1.set_yticks(ln_y1)
-        ax1.set_yticklabels([np.int(y) for y in covid19_data.y01_plot_data]) 
-
-        ax1.set_xlabel("Days for %s - Day 1 is %s" %(self.location, start_date_label))
         ax1.set_ylabel("Number of reported cases on given day DD")
-
-        ax1_title = "Linear Fit of " + \
-                        "log cases $N=Ce^{bt}$ with " + \
-                        "$b=$%.3f day$^{-1}$ (red, %s) and $t$ in days\n" % (slope, self.location) + \
-                        "Coef. of Determination $R^{2}$=%.2f" % R + " and Est. Daily $R_0$ (Reproductive Number)=%.2f" % R0
-
-        ax1.set_title(ax1_title)
         ax1.title.set_fontsize(11.5)
-        ax1.legend(loc="lower right")
-        
-
-        #Very steep rise in infections
-        if slope > 0.12:
-            scale_offset = 0.85
-        #Steep curve
-        elif slope > 0.09 and slope <= 0.12:
-            scale_offset = 0.7
-        #Curve is a bit steep 
-        elif slope > 0.05 and slope <= 0.09:
-            scale_offset = 0.55
-        #Most countries are here and flattening their infection rates
-        elif slope >= 0.009 and slope < 0.05:
-            scale_offset = 0.38
-        #Very flat curve
-        elif slope > 0 and slope < 0.009:
-            scale_offset = 0.14
-        #Downward revision of cases
-        elif slope <= 0:
-            scale_offset = 0
-
-        slope_image = np.array([IMAGE_ROW_VALUES])
 
         #Show as shades of greys
         slope_cmap = colors.LinearSegmentedColormap.from_list('custom grey', [(0.0, '#FFFFFF'), (0.5, '#C0C0C0'), (1.0 ,'#606060')] , N=256)
+        ax2.imshow(np.array([IMAGE_ROW_VALUES]), interpolation='nearest', cmap=slope_cmap, aspect='auto')
 
-        #Build the image showing slope of the curve
-
-        ax2.imshow(slope_image ,interpolation='nearest',  cmap=slope_cmap, aspect='auto')
-
-        ax2.xaxis.axes.annotate('%s:\nSlope of \nthe curve is %.3f' %(self.location, slope), ha="center", xy=(scale_offset+0.001*slope, 0), xycoords='axes fraction',
-            xytext=(0.5, 0.5), textcoords='axes fraction', 
+        self._slope_arrow = ax2.annotate('', ha="center", xy=(0, 0), xycoords='axes fraction',
+            xytext=(0.5, 0.5), textcoords='axes fraction',
             arrowprops=dict(arrowstyle="simple", facecolor='black'), fontsize=9.5, va="bottom")
 
-        ax2.xaxis.axes.annotate('Slope b = 0\nCompletely\nFlat Curve',  xy=(0, 0), xycoords='axes fraction', 
+        ax2.annotate('Slope b = 0\nCompletely\nFlat Curve',  xy=(0, 0), xycoords='axes fraction',
             xytext=(0.1, 0.1), textcoords='axes fraction', arrowprops=dict(arrowstyle="-|>", facecolor='black'), fontsize=9.5, va="bottom")
- 
-        ax2.xaxis.axes.annotate('Steep\n Curve', xy=(1, 0), xycoords='axes fraction', xytext=(0.9,0.1), #Provide a bit offset for the text, so not to overlap axis boundary 
-            textcoords='axes fraction', 
-            arrowprops=dict(arrowstyle="-|>", facecolor='black'), 
+
+        ax2.annotate('Steep\n Curve', xy=(1, 0), xycoords='axes fraction', xytext=(0.9,0.1), #Provide a bit offset for the text, so not to overlap axis boundary
+            textcoords='axes fraction',
+            arrowprops=dict(arrowstyle="-|>", facecolor='black'),
             fontsize=9.5)
 
         ax2.xaxis.set_visible(False)
         ax2.yaxis.set_visible(False)
-        ax2.set_title('Infection\'s Exponential Curve Slope $b=$%.3f day$^{-1}$:' % (slope))
         ax2.title.set_fontsize(11.5)
 
-        #Build doubling timeimage
-        doubling_time_cmap = colors.LinearSegmentedColormap.from_list('custom roy', self.get_doubling_time_cmap(d_time) , N=256)
-        dtime_image = np.array([IMAGE_ROW_VALUES])
-        ax3.imshow(dtime_image ,interpolation='nearest',  cmap=doubling_time_cmap, aspect='auto')
-
-        #Determine location and label for doubling time at 60 days
-        if d_time > 60:
-            dtime_60_loc = 60/d_time
-            dtime_60_label = dtime_60_loc
-            dtime_loc = 1.0
-        elif d_time <= 60 and d_time >= 50:
-            dtime_60_loc = 1.0
-            #Allow for small offset from right boundary of axis.
-            dtime_60_label = 0.80
-            dtime_loc = d_time/60
-        elif d_time < 50 and d_time > 0:
-            dtime_60_loc = 1.0
-            dtime_60_label = 0.80
-            dtime_loc = d_time/60
-        elif d_time < 0:
-            dtime_60_loc = 1.0
-            dtime_60_label = 0.80
-            dtime_loc = -0.08
-
-
-        ax3.xaxis.axes.annotate('%s:\nDoubling Time is %.1f days' %(self.location, d_time), ha="center", xy=(dtime_loc, 0), xytext=(0.5, 0.6), 
+        #Build doubling time image, its colour map is switched for each location
+        self._doubling_time_cmaps = [colors.LinearSegmentedColormap.from_list('custom roy', dtime_colors, N=256) for dtime_colors in DOUBLING_TIME_COLORS]
+        self._dtime_image = ax3.imshow(np.array([IMAGE_ROW_VALUES]), interpolation='nearest', cmap=self._doubling_time_cmaps[0], aspect='auto')
+
+        self._dtime_arrow = ax3.annotate('', ha="center", xy=(0, 0), xytext=(0.5, 0.6),
             xycoords='axes fraction', textcoords='axes fraction', arrowprops=dict(arrowstyle="simple", facecolor='black'), fontsize=9.5, va="bottom")
 
-        ax3.xaxis.axes.annotate('Doubling Time\n at 1 day\n(Very Fast Virus Growth)',  xy=(0, 0), xycoords='axes fraction', 
+        ax3.annotate('Doubling Time\n at 1 day\n(Very Fast Virus Growth)',  xy=(0, 0), xycoords='axes fraction',
             xytext=(0.1, 0.15), textcoords='axes fraction', arrowprops=dict(arrowstyle="-|>", facecolor='black'), fontsize=9.5, va="bottom")
- 
-        ax3.xaxis.axes.annotate('Doubling Time\n at 60 days', xy=(dtime_60_loc, 0), xycoords='axes fraction', xytext=(dtime_60_label,0.37), #Provide a bit offset for the text  
-            textcoords='axes fraction', 
+
+        self._dtime_60_arrow = ax3.annotate('Doubling Time\n at 60 days', xy=(1.0, 0), xycoords='axes fraction', xytext=(0.80,0.37), #Provide a bit offset for the text
+            textcoords='axes fraction',
             arrowprops=dict(arrowstyle="-|>", facecolor='black'), fontsize=9.5, va="bottom")
         ax3.xaxis.set_visible(False)
         ax3.yaxis.set_visible(False)
 
         ax3.set_title('Population Doubling time of Infections:')
         ax3.title.set_fontsize(11.5)
-        
-        date_info = '%s - %s' %(start_date_label, end_date_label) 
-        plt.suptitle('COVID-19 Epidemic in %s \n%s' %(self.location, date_info), fontsize=16)
-        #plt.rc('axes', titlesize=7) 
-        plt.show()
 
+        self._suptitle = figure.suptitle('', fontsize=16)
+
+    @property
+    def figure(self):
+        return self._figure
+
+    @timed_stage('render')
+    def draw(self, location, x, y, ln_y, fit_y, slope, r_squared, r0, d_time, start_date_label, end_date_label):
+        """ Update the figure with the data and fit of a location.
+
+        Parameters:
+            location
+                Name of the location shown in the labels
+            x, y
+                Day numbers and reported case values
+            ln_y, fit_y
+                Natural log of the case values and the fitted line values
+            slope, r_squared, r0, d_time
+                Fit statistics
+            start_date_label, end_date_label
+                Readable first and last dates
+
+        """
+        ax1, ax2, ax3 = self._axes
+        x = np.asarray(x, dtype=float)
+        ln_y = np.asarray(ln_y, dtype=float)
+        fit_y = np.asarray(fit_y, dtype=float)
+        y_error = np.abs(fit_y - ln_y)  # error
+
+        # Update the linear plot
+        self._points.set_data(x, ln_y)
+        self._fit_line.set_data(x, fit_y)
+        self._error_points.set_data(x, ln_y)
+        self._error_lines.set_segments(np.stack([np.c_[x, ln_y - y_error], np.c_[x, ln_y + y_error]], axis=1))
+        self._points.set_label(location)
+        self._fit_line.set_label(location)
+
+        #Days dropped by the data quality pass are NaN, they are not drawn or labelled
+        finite = np.isfinite(ln_y)
+        x_margin = 0.05 * max(x[-1] - x[0], 1.0)
+        y_low, y_high = (np.min((ln_y - y_error)[finite]), np.max((ln_y + y_error)[finite])) if finite.any() else (0.0, 1.0)
+        y_margin = 0.05 * max(y_high - y_low, 1e-3)
+        ax1.set_xlim(x[0] - x_margin, x[-1] + x_margin)
+        ax1.set_ylim(y_low - y_margin, y_high + y_margin)
+        ax1.set_yticks(ln_y[finite])
+        ax1.set_yticklabels([int(value) for value in np.asarray(y)[finite]])
+
+        ax1.set_xlabel("Days for %s - Day 1 is %s" %(location, start_date_label))
+        ax1.set_title("Linear Fit of " + \
+                        "log cases $N=Ce^{bt}$ with " + \
+                        "$b=$%.3f day$^{-1}$ (red, %s) and $t$ in days\n" % (slope, location) + \
+                        "Coef. of Determination $R^{2}$=%.2f" % r_squared + " and Est. Daily $R_0$ (Reproductive Number)=%.2f" % r0)
+        ax1.legend(handles=[self._points, self._fit_line], loc="lower right")
+
+        # Update the slope arrow
+        self._slope_arrow.set_text('%s:\nSlope of \nthe curve is %.3f' %(location, slope))
+        self._slope_arrow.xy = (get_slope_scale_offset(slope)+0.001*slope, 0)
+        ax2.set_title('Infection\'s Exponential Curve Slope $b=$%.3f day$^{-1}$:' % (slope))
+
+        # Update the doubling time colours and arrows
+        self._dtime_image.set_cmap(self._doubling_time_cmaps[get_doubling_time_color_level(d_time)])
+        dtime_loc, dtime_60_loc, dtime_60_label = get_doubling_time_positions(d_time)
+        self._dtime_arrow.set_text('%s:\nDoubling Time is %.1f days' %(location, d_time))
+        self._dtime_arrow.xy = (dtime_loc, 0)
+        self._dtime_60_arrow.xy = (dtime_60_loc, 0)
+        self._dtime_60_arrow.xyann = (dtime_60_label, 0.37)
+
+        self._suptitle.set_text('COVID-19 Epidemic in %s \n%s - %s' %(location, start_date_label, end_date_label))
+
+    @timed_stage('render')
+    def save(self, path, fmt=None):
+        """Save the figure, the format is taken from the file extension if not given, e.g. png or svg."""
+        self._figure.savefig(path, format=fmt)
+
+# Colours of the locations in the comparison plot, repeated when there are more locations
+COMPARISON_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+class Covid19ComparisonRenderer:
+    """The linear plots of many locations overlaid on one figure, with a slope bar and a doubling time bar per location.
+
+    Like Covid19PlotRenderer, the artists are created in the constructor and draw only updates them. The points of
+    all locations are one scatter collection and the fitted lines and bars are line collections, so dozens of
+    locations are drawn with a handful of artists.
+    """
+
+    @timed_stage('render')
+    def __init__(self, figure=None):
+        """Constructor"""
+        from matplotlib import colors, patheffects
+        from matplotlib.collections import LineCollection
+        if figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            figure = Figure(figsize=(14,10)) #width and height
+            FigureCanvasAgg(figure)
+        self._figure = figure
+
+        grid = figure.add_gridspec(2, 2, width_ratios=[3, 2])
+        ax1 = figure.add_subplot(grid[:, 0])
+        ax2 = figure.add_subplot(grid[0, 1])
+        ax3 = figure.add_subplot(grid[1, 1])
+        self._axes = (ax1, ax2, ax3)
+
+        # Overlaid linear plots, the points of every location and the fitted lines
+        self._points = ax1.scatter([], [], s=16, zorder=3)
+        self._fit_lines = LineCollection([], linestyles='dashed', linewidths=1.5)
+        ax1.add_collection(self._fit_lines)
+        ax1.grid()
+        ax1.set_ylabel("Number of reported cases on given day DD")
+        ax1.title.set_fontsize(11.5)
+
+        #Slope bars over the grey scale of the single location plot
+        slope_cmap = colors.LinearSegmentedColormap.from_list('custom grey', [(0.0, '#FFFFFF'), (0.5, '#C0C0C0'), (1.0 ,'#606060')] , N=256)
+        self._slope_image = ax2.imshow(np.array([IMAGE_ROW_VALUES]), interpolation='nearest', cmap=slope_cmap, aspect='auto')
+        #The bars are outlined in black to stand out from the colour scales
+        self._bar_outline = patheffects.withStroke
+        self._slope_bars = LineCollection([])
+        ax2.add_collection(self._slope_bars)
+        ax2.axvline(0, color='black', linewidth=1)
+        ax2.set_title('Infection\'s Exponential Curve Slope $b$ day$^{-1}$:')
+        ax2.title.set_fontsize(11.5)
+
+        #Doubling time bars over the red to yellow scale of doubling times up to 60 days
+        dtime_cmap = colors.LinearSegmentedColormap.from_list('custom roy', DOUBLING_TIME_COLORS[0], N=256)
+        self._dtime_image = ax3.imshow(np.array([IMAGE_ROW_VALUES]), interpolation='nearest', cmap=dtime_cmap, aspect='auto')
+        self._dtime_bars = LineCollection([])
+        ax3.add_collection(self._dtime_bars)
+        ax3.axvline(60, color='black', linestyle='--', linewidth=1)
+        ax3.set_title('Population Doubling time of Infections (days):')
+        ax3.title.set_fontsize(11.5)
+
+        self._suptitle = figure.suptitle('', fontsize=16)
+
+    @property
+    def figure(self):
+        return self._figure
+
+    @timed_stage('render')
+    def draw(self, location_fits, start_date_label, end_date_label):
+        """ Update the figure with the data and fits of the locations.
+
+        Parameters:
+            location_fits
+                List of LocationFit of the locations, e.g. from fit_locations
+            start_date_label, end_date_label
+                Readable first and last dates
+
+        """
+        from matplotlib.lines import Line2D
+        ax1, ax2, ax3 = self._axes
+        n_locations = len(location_fits)
+        rows = np.arange(n_locations)
+        location_colors = [COMPARISON_COLORS[row % len(COMPARISON_COLORS)] for row in rows]
+        names = [location_fit.name for location_fit in location_fits]
+        slope = np.array([location_fit.fit.slope for location_fit in location_fits])
+        intercept = np.array([location_fit.fit.intercept for location_fit in location_fits])
+        d_time = np.array([location_fit.fit.doubling_time for location_fit in location_fits])
+
+        # Update the linear plots, all locations have the same days
+        x = location_fits[0].x
+        ln_y = np.vstack([location_fit.ln_y for location_fit in location_fits])
+        self._points.set_offsets(np.c_[np.tile(x, n_locations), ln_y.ravel()])
+        self._points.set_facecolors(np.repeat(location_colors, len(x)))
+        self._fit_lines.set_segments(np.stack([np.c_[np.full(n_locations, x[0]), slope * x[0] + intercept],
+                                               np.c_[np.full(n_locations, x[-1]), slope * x[-1] + intercept]], axis=1))
+        self._fit_lines.set_colors(location_colors)
+
+        x_margin = 0.05 * max(x[-1] - x[0], 1.0)
+        y_low, y_high = (np.nanmin(ln_y), np.nanmax(ln_y)) if np.isfinite(ln_y).any() else (0.0, 1.0)
+        y_margin = 0.05 * max(y_high - y_low, 1e-3)
+        ax1.set_xlim(x[0] - x_margin, x[-1] + x_margin)
+        ax1.set_ylim(y_low - y_margin, y_high + y_margin)
+
+        #Case values of different sizes are labelled at the powers of 10
+        powers = np.arange(np.floor(y_low / np.log(10)), np.ceil(y_high / np.log(10)) + 1)
+        ax1.set_yticks(powers * np.log(10))
+        ax1.set_yticklabels(['%d' % 10**power for power in powers])
+
+        ax1.set_xlabel("Days - Day 1 is %s" % start_date_label)
+        ax1.set_title("Linear Fit of log cases $N=Ce^{bt}$ with $t$ in days\nof %d locations (dashed lines)" % n_locations)
+        fontsize = 9.5 if n_locations <= 20 else max(5.0, 190.0 / n_locations)
+        ax1.legend(handles=[Line2D([], [], color=color, marker='o', linestyle='--', label=name) for name, color in zip(names, location_colors)],
+                   loc="lower right", fontsize=fontsize)
+
+        #Bars get thinner with more locations so the rows do not overlap
+        bar_width = min(8.0, 160.0 / n_locations)
+        for bars in (self._slope_bars, self._dtime_bars):
+            bars.set_linewidth(bar_width)
+            bars.set_path_effects([self._bar_outline(linewidth=bar_width + 2, foreground='black')])
+
+        # Update the slope bars, one row per location from the top
+        slope_low, slope_high = min(0.0, slope.min()) * 1.1, max(0.15, slope.max() * 1.1)
+        self._slope_bars.set_segments(np.stack([np.c_[np.zeros(n_locations), rows], np.c_[slope, rows]], axis=1))
+        self._slope_bars.set_colors(location_colors)
+        self._slope_image.set_extent([0, slope_high, n_locations - 0.5, -0.5])
+        ax2.set_xlim(slope_low, slope_high)
+        ax2.set_ylim(n_locations - 0.5, -0.5)
+        ax2.set_yticks(rows)
+        ax2.set_yticklabels(['%s %.3f' %(name, value) for name, value in zip(names, slope)], fontsize=fontsize)
+
+        # Update the doubling time bars, falling curves have no doubling time and longer times are cut at the right side
+        positive = np.isfinite(d_time) & (d_time > 0)
+        dtime_high = max(66.0, min(120.0, d_time[positive].max() * 1.1)) if positive.any() else 66.0
+        bar_length = np.clip(np.nan_to_num(d_time, nan=0.0, posinf=dtime_high), 0, dtime_high)
+        self._dtime_bars.set_segments(np.stack([np.c_[np.zeros(n_locations), rows], np.c_[bar_length, rows]], axis=1))
+        self._dtime_bars.set_colors(location_colors)
+        self._dtime_image.set_extent([0, 60, n_locations - 0.5, -0.5])
+        ax3.set_xlim(0, dtime_high)
+        ax3.set_ylim(n_locations - 0.5, -0.5)
+        ax3.set_yticks(rows)
+        ax3.set_yticklabels(['%s %.1f' %(name, value) for name, value in zip(names, d_time)], fontsize=fontsize)
+
+        self._suptitle.set_text('COVID-19 Epidemic in %d Locations \n%s - %s' %(n_locations, start_date_label, end_date_label))
+
+    @timed_stage('render')
+    def save(self, path, fmt=None):
+        """Save the figure, the format is taken from the file extension if not given, e.g. png or svg."""
+        self._figure.savefig(path, format=fmt)
+
+# Renderer and dataset of each process of render_locations
+_render_worker = {}
+
+def _init_render_worker(dataset, output_dir, fmt, start_idx, end_idx):
+    _render_worker.update(renderer=Covid19PlotRenderer(), dataset=dataset, output_dir=output_dir, fmt=fmt,
+                          start_idx=start_idx, end_idx=end_idx)
+
+def _render_location(location, data_location):
+    """Fit and save the figure of one location, runs in a render_locations worker process."""
+    location_fit = fit_location(_render_worker['dataset'], location, data_location, _render_worker['start_idx'], _render_worker['end_idx'])
+
+    file_name = '%s_%s.%s' %(data_location.name, re.sub(r'[^\w.-]+', '_', location_fit.name), _render_worker['fmt'])
+    path = os.path.join(_render_worker['output_dir'], file_name)
+    renderer = _render_worker['renderer']
+    draw_location_fit(renderer, location_fit)
+    renderer.save(path, _render_worker['fmt'])
+    return path
+
+def render_locations(dataset, locations, output_dir, fmt='png', start=None, end=None, snap=False, processes=None):
+    """ Render and save the figures of many locations in parallel, without showing them.
+
+    Each worker process builds one Covid19PlotRenderer and reuses it for all the locations it renders.
+
+    Parameters:
+        dataset
+            Covid19Dataset with the loaded time series
+        locations
+            List of (location name, DataLocation) tuples
+        output_dir
+            Directory of the image files, created if needed
+        fmt
+            Image format, png or svg
+        start, end, snap
+            Optional start and end dates, same as batch_fit
+        processes
+            Number of worker processes, default is the number of CPUs
+
+    Returns:
+        List of the saved file paths, in the order of the locations
+
+    """
+    start_idx, end_idx = dataset.get_date_indices(start, end, snap)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_render_worker,
+                                                initargs=(dataset, output_dir, fmt, start_idx, end_idx)) as executor:
+        futures = [executor.submit(_render_location, location, data_location) for location, data_location in locations]
+        return [future.result() for future in futures]
+
+# Default location and limits of the parsed data cache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'covid19-linear-plot')
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_CACHE_MAX_AGE = 30 * 24 * 3600
+
+class Covid19Cache:
+    """On-disk cache of parsed time series files, so repeated runs skip the CSV download and parsing.
+
+    Every URL has one entry made of a .npy file with the case values (opened memory-mapped) and a small .json
+    file with the location columns, the date columns and the validator (ETag, Last-Modified or content hash) of
+    the source. Entries not used for max_age seconds are removed, then the least recently used entries are
+    removed until the cache is smaller than max_bytes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, max_age=DEFAULT_CACHE_MAX_AGE):
+        """Constructor"""
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def _entry_paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self._cache_dir, key + '.npy'), os.path.join(self._cache_dir, key + '.json')
+
+    @staticmethod
+    def get_remote_validator(url):
+        """Get the ETag or Last-Modified header of a web URL, returns None for local files or if the server has neither."""
+        if not url.startswith(('http://', 'https://')):
+            return None
+        import urllib.request
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, method='HEAD')) as response:
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except OSError:
+            return None
+        if etag:
+            return 'etag:' + etag
+        if last_modified:
+            return 'last-modified:' + last_modified
+        return None
+
+    def load(self, url, validator=None):
+        """ Load a cached entry.
+
+        Returns:
+            Tuple of the metadata dict and the memory-mapped counts matrix, or None if the entry is missing or stale.
+            Without a validator, a stale entry is returned too.
+
+        """
+        npy_path, json_path = self._entry_paths(url)
+        try:
+            with open(json_path) as f:
+                metadata = json.load(f)
+            if metadata['url'] != url or (validator is not None and metadata['validator'] != validator):
+                return None
+            counts = np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+
+        #Mark the entry as recently used for the eviction
+        os.utime(json_path)
+        return metadata, counts
+
+    def store(self, url, validator, metadata, counts):
+        """Write an entry, replacing any previous entry for the same URL, then evict old entries."""
+        npy_path, json_path = self._entry_paths(url)
+        metadata = dict(metadata, url=url, validator=validator, created=time.time())
+
+        #Write to temporary files first so a reader never sees a partial entry
+        np.save(npy_path + '.tmp.npy', np.ascontiguousarray(counts))
+        #json.dumps encodes in one call with the C encoder, json.dump to a file encodes item by item in Python
+        with open(json_path + '.tmp', 'w') as f:
+            f.write(json.dumps(metadata))
+        os.replace(npy_path + '.tmp.npy', npy_path)
+        os.replace(json_path + '.tmp', json_path)
+
+        self.evict()
+
+    def evict(self):
+        """Remove entries older than max_age, then the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self._cache_dir):
+            if not name.endswith('.json'):
+                continue
+            json_path = os.path.join(self._cache_dir, name)
+            npy_path = json_path[:-len('.json')] + '.npy'
+            try:
+                last_used = os.path.getmtime(json_path)
+                size = os.path.getsize(json_path) + (os.path.getsize(npy_path) if os.path.exists(npy_path) else 0)
+            except OSError:
+                continue
+            entries.append((last_used, size, json_path, npy_path))
+
+        entries.sort()
+        total_size = sum(entry[1] for entry in entries)
+        for last_used, size, json_path, npy_path in entries:
+            if now - last_used <= self._max_age and total_size <= self._max_bytes:
+                break
+            for path in (json_path, npy_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+
+# Files of the columnar format written by Covid19Dataset.export, the manifest is written last
+COLUMNAR_MANIFEST = 'manifest.json'
+COLUMNAR_FORMAT = 'covid19-linear-plot-columnar'
+COLUMNAR_VERSION = 1
+COLUMNAR_ARRAYS = ['counts', 'dates', 'province_codes', 'country_codes', 'lat', 'long', 'fit_sums']
+
+def is_columnar_dataset(path):
+    """True if path is a directory written by Covid19Dataset.export."""
+    return os.path.isfile(os.path.join(path, COLUMNAR_MANIFEST))
+
+class Covid19Dataset:
+    """The whole COVID-19 time series file held as one matrix, so all locations can be fitted in a single pass."""
+
+    @timed_stage('load')
+    def __init__(self, url, cache=None, table=None):
+        """Constructor
+
+        The url is a web URL or path of a CSV file, or a directory written by export, which is opened memory-mapped
+        and not cached. A TimeSeriesTable of the file that is already read, e.g. the selected rows and dates from
+        stream_time_series_csv, can be passed in as table, it is not cached.
+        """
+        self._url = url
+        if table is not None:
+            cache = None
+
+        cached = None
+        stale = None
+        validator = None
+        content = None
+        columnar = table is None and is_columnar_dataset(url)
+        if cache is not None and not columnar:
+            #Web servers give a cheap validator, otherwise the file content has to be read and hashed
+            validator = cache.get_remote_validator(url)
+            if validator is None:
+                content = self._read_content(url)
+                validator = 'sha1:' + hashlib.sha1(content).hexdigest()
+            #The entry is read once, a stale entry is still used to append the new dates to
+            stale = cache.load(url)
+            if stale is not None and stale[0]['validator'] == validator:
+                cached, stale = stale, None
+
+        if table is not None:
+            self._set_from_table(table)
+
+        #Exported data is opened memory-mapped with the dates and the location codes already parsed
+        elif columnar:
+            self._open_columnar(url)
+
+        elif cached is not None:
+            self._set_from_metadata(*cached)
+
+        #The file changed since it was cached, usually by new date columns that are appended to the cached data
+        elif stale is not None:
+            self._set_from_metadata(*stale)
+            if content is None:
+                content = self._read_content(url)
+            if not self._append_new_dates(content):
+                self._parse(content)
+
+        else:
+            self._parse(content if content is not None else url)
+
+        #Dates of the columns, parsed once for binary search lookups
+        if not columnar:
+            self._dates = parse_csv_dates(self._date_columns)
+
+        self._build_location_index()
+
+        if cache is not None and cached is None and not columnar:
+            cache.store(url, validator, self._get_metadata(), self._counts)
+
+    def _build_location_index(self):
+        """Build the province/state to row and country/region to total row lookups, once per dataset load."""
+        provinces = self.provinces
+        self._province_rows = np.flatnonzero(provinces != '')
+        self._province_index = {provinces[row].casefold(): row for row in self._province_rows}
+
+        self._group_countries()
+        self._country_index = {name.casefold(): idx for idx, name in enumerate(self._country_names)}
+
+        #Country and world totals are reductions of the counts, computed when first used, single countries are
+        #kept by their position in the country names until all the totals are computed
+        self._country_totals = None
+        self._country_total_rows = {}
+        self._world_total = None
+
+    def _group_countries(self):
+        codes = self._country_codes
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+        #Rows of each country are usually next to each other in the file, then they are summed in place
+        if len(starts) == len(self._country_categories):
+            self._country_order = None
+            self._country_group_order = np.argsort(codes[starts])
+            self._country_starts = starts
+            self._country_names = self._country_categories[codes[starts][self._country_group_order]]
+
+        #Otherwise the rows are summed in the order sorted by country
+        else:
+            self._country_order = np.argsort(codes, kind='stable')
+            sorted_codes = codes[self._country_order]
+            self._country_group_order = None
+            self._country_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+            self._country_names = self._country_categories[sorted_codes[self._country_starts]]
+        self._country_bounds = np.r_[self._country_starts, len(codes)]
+
+    def _country_rows(self, idx):
+        """Rows of the data of the country/region at position idx of the country names."""
+        bounds = self._country_bounds
+        if self._country_order is None:
+            group = self._country_group_order[idx]
+            return slice(bounds[group], bounds[group + 1])
+        return self._country_order[bounds[idx]:bounds[idx + 1]]
+
+    def _sum_by_country(self, values):
+        """Sum the rows of values (one row per row of the data) by country/region, in the order of the country names."""
+        values = np.asarray(values)
+        dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else None
+        if self._country_order is None:
+            return np.add.reduceat(values, self._country_starts, axis=0, dtype=dtype)[self._country_group_order]
+        return np.add.reduceat(values[self._country_order], self._country_starts, axis=0, dtype=dtype)
+
+    def _set_names(self, provinces, countries):
+        """Keep the names as codes into sorted arrays of the distinct names, which are interned strings."""
+        categories, codes = np.unique(np.asarray(provinces, dtype=object), return_inverse=True)
+        self._province_categories = np.array([sys.intern(str(name)) for name in categories], dtype=object)
+        self._province_codes = codes.astype(np.int32)
+
+        categories, codes = np.unique(np.asarray(countries, dtype=object), return_inverse=True)
+        self._country_categories = np.array([sys.intern(str(name)) for name in categories], dtype=object)
+        self._country_codes = codes.astype(np.int32)
+
+    def _parse(self, source):
+        """Read the whole file, source is a URL, a file path or the file content."""
+        #Read the file once and keep the location columns and the date columns apart
+        content = source if isinstance(source, bytes) else self._read_content(source)
+        self._set_from_table(read_time_series_csv(content))
+        self._rows_digest = self._digest_rows(content.splitlines()[1:], self._counts.shape[0])
+
+    @staticmethod
+    def _digest_rows(lines, n_rows):
+        """Digest of the raw text of the data lines, None if they are not one line per row, see _append_new_dates."""
+        if len(lines) != n_rows:
+            return None
+        return hashlib.sha1(b'\n'.join(lines)).hexdigest()
+
+    def _set_from_table(self, table):
+        self._set_names(table.provinces, table.countries)
+        self._lat = table.lat
+        self._long = table.long
+        self._date_columns = table.date_columns
+        self._counts = table.counts
+        self._fit_sums = None
+        self._rows_digest = None
+
+    def _set_from_metadata(self, metadata, counts):
+        self._counts = counts
+        self._set_names(metadata['provinces'], metadata['countries'])
+        self._lat = np.array(metadata['lat'], dtype=float)
+        self._long = np.array(metadata['long'], dtype=float)
+        self._date_columns = metadata['date_columns']
+        self._fit_sums = np.array(metadata['fit_sums'], dtype=float) if 'fit_sums' in metadata else None
+        self._rows_digest = metadata.get('rows_digest')
+
+    def _get_metadata(self):
+        return {'provinces': list(self.provinces), 'countries': list(self.countries),
+                'lat': list(self._lat), 'long': list(self._long), 'date_columns': self._date_columns,
+                'fit_sums': self.get_fit_sums().tolist(), 'rows_digest': self._rows_digest}
+
+    def _append_new_dates(self, content):
+        """ Append the date columns that are not in the loaded data yet, converting only those columns to numbers.
+
+        The date fields never contain commas, so the new date fields are split from the end of every line and the
+        rest of the line has to be the same text as in the loaded file. That is checked with the digest of the loaded
+        lines, so past values that were revised, or changed locations, are found without parsing them again. The
+        running sums of the fit statistics are updated with the new days only.
+
+        Returns:
+            False if the file does not only add new dates (other locations, missing dates or revised values), or the
+            loaded data has no digest of its lines, then nothing is changed.
+
+        """
+        lines = content.splitlines()
+        header = lines[0].decode('utf-8-sig') if lines else ''
+        date_columns = header.strip().split(',')[4:]
+        n_loaded = len(self._date_columns)
+        n_new = len(date_columns) - n_loaded
+        if self._rows_digest is None or n_new < 0 or date_columns[:n_loaded] != self._date_columns:
+            return False
+
+        fields = [line.rsplit(b',', n_new) for line in lines[1:]] if n_new else [[line] for line in lines[1:]]
+        if any(len(line_fields) != n_new + 1 for line_fields in fields):
+            return False
+        if self._digest_rows([line_fields[0] for line_fields in fields], self._counts.shape[0]) != self._rows_digest:
+            return False
+
+        if n_new == 0:
+            return True
+
+        new_counts = compact_counts(_parse_counts([line_fields[1:] for line_fields in fields], n_new)).astype(np.int64)
+
+        #Add the sums of the new days to the running sums, days are numbered from 1 at the first date of the data
+        if self._fit_sums is not None:
+            self._group_countries()
+            x = np.arange(len(self._date_columns) + 1, len(date_columns) + 1, dtype=float)
+            new_matrix = np.vstack([new_counts[self.provinces != ''], self._sum_by_country(new_counts), new_counts.sum(axis=0)])
+            self._fit_sums = self._fit_sums + log_linear_sums(x, log_cases(new_matrix))
+
+        self._counts = compact_counts(np.hstack([self._counts, new_counts]))
+        self._date_columns = date_columns
+        self._rows_digest = self._digest_rows(lines[1:], self._counts.shape[0])
+        return True
+
+    def _open_columnar(self, path):
+        with open(os.path.join(path, COLUMNAR_MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != COLUMNAR_FORMAT or manifest.get('version') != COLUMNAR_VERSION:
+            raise ValueError('%s is not a version %d COVID-19 columnar data directory' %(path, COLUMNAR_VERSION))
+
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in COLUMNAR_ARRAYS}
+        self._counts = arrays['counts']
+        self._dates = arrays['dates']
+        self._province_categories = np.array([sys.intern(name) for name in manifest['province_names']], dtype=object)
+        self._province_codes = arrays['province_codes']
+        self._country_categories = np.array([sys.intern(name) for name in manifest['country_names']], dtype=object)
+        self._country_codes = arrays['country_codes']
+        self._lat = arrays['lat']
+        self._long = arrays['long']
+        self._date_columns = manifest['date_columns']
+        self._fit_sums = arrays['fit_sums']
+        self._rows_digest = None
+
+    def export(self, path):
+        """ Write the data to a directory in a columnar format that is opened memory-mapped, without parsing.
+
+        Every column is a .npy file: the case values matrix with one row per row of the data (a location's dates are
+        next to each other), the dates as datetime64[D], the province/state and country/region codes, the latitudes,
+        longitudes and the fit sums. manifest.json has the distinct names of the codes and the date column names.
+        Open the directory by passing its path as the url of Covid19Dataset or Covid19Data.
+
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {'counts': np.ascontiguousarray(self._counts), 'dates': self._dates,
+                  'province_codes': self._province_codes, 'country_codes': self._country_codes,
+                  'lat': self._lat, 'long': self._long, 'fit_sums': self.get_fit_sums()}
+
+        #Write to temporary files first, the manifest is replaced last so an incomplete export is never opened
+        for name in COLUMNAR_ARRAYS:
+            npy_path = os.path.join(path, name + '.npy')
+            np.save(npy_path + '.tmp.npy', np.asarray(arrays[name]))
+            os.replace(npy_path + '.tmp.npy', npy_path)
+
+        manifest = {'format': COLUMNAR_FORMAT, 'version': COLUMNAR_VERSION, 'source': self._url, 'created': time.time(),
+                    'shape': list(self._counts.shape), 'date_columns': self._date_columns,
+                    'province_names': list(self._province_categories), 'country_names': list(self._country_categories)}
+        manifest_path = os.path.join(path, COLUMNAR_MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    @staticmethod
+    def _read_content(url):
+        if url.startswith(('http://', 'https://')):
+            import urllib.request
+            with urllib.request.urlopen(url) as response:
+                return response.read()
+        with open(url, 'rb') as f:
+            return f.read()
+
+    def to_dataframe(self):
+        """Rebuild the data frame in the same layout as the Johns Hopkins CSV file."""
+        import pandas as pd
+        df = pd.DataFrame(np.asarray(self._counts), columns=self._date_columns)
+        df.insert(0, 'Long', self._long)
+        df.insert(0, 'Lat', self._lat)
+        df.insert(0, 'Country/Region', self.countries)
+        df.insert(0, 'Province/State', np.where(self.provinces == '', np.nan, self.provinces))
+        return df
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def date_columns(self):
+        return self._date_columns
+
+    @property
+    def dates(self):
+        return self._dates
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def provinces(self):
+        """Province/state name of every row of the data, empty for country rows."""
+        return self._province_categories[self._province_codes]
+
+    @property
+    def countries(self):
+        """Country/region name of every row of the data."""
+        return self._country_categories[self._country_codes]
+
+    @property
+    def country_totals(self):
+        """Case values of every country/region, one row per name of location_names, summed when first used."""
+        if self._country_totals is None:
+            self._country_totals = self._sum_by_country(self._counts)
+        return self._country_totals
+
+    @property
+    def world_total(self):
+        """Case values of the world, summed when first used."""
+        if self._world_total is None:
+            self._world_total = self._counts.sum(axis=0, dtype=np.int64)
+        return self._world_total
+
+    @timed_stage('dates')
+    def get_date_indices(self, start, end, snap=False):
+        """ Get the column positions of the start and end dates in the counts matrix.
+
+        Parameters:
+            start, end
+                Dates entered by the user in one of the DATE_FORMATS, datetime or datetime64 values, or None for the first / last date of the data.
+            snap
+                If True, dates outside the data or missing from it are moved to the nearest available date
+
+        Returns:
+            Tuple of the start and end column positions, end position is inclusive.
+
+        """
+        return get_date_range_indices(self._dates, start, end, snap)
+
+    def location_names(self, data_location):
+        """List the names of the provinces/states or countries/regions in the data."""
+        if data_location == DataLocation.province_state:
+            return list(self.provinces[self._province_rows])
+        elif data_location == DataLocation.country_region:
+            return list(self._country_names)
+        return ['The World']
+
+    @timed_stage('select')
+    def find_location(self, location, data_location):
+        """ Find a location by name, ignoring case and allowing small spelling differences, e.g. 'quebek' for Quebec.
+
+        Parameters:
+            location
+                Name of the province/state or country/region, not used for the world
+            data_location
+                DataLocation type of the name
+
+        Returns:
+            Tuple of the name as written in the data and the case values of the location (a row of the data, not a copy)
+
+        """
+        if data_location == DataLocation.world:
+            return location, self.world_total
+
+        if data_location == DataLocation.province_state:
+            index, names, values = self._province_index, self.provinces, self._counts
+        else:
+            index, names, values = self._country_index, self._country_names, self._country_totals
+
+        key = location.casefold()
+        if key not in index:
+            close_matches = difflib.get_close_matches(key, index.keys(), n=1, cutoff=0.8)
+            if not close_matches:
+                raise KeyError('%s was not found in the COVID-19 data' % location)
+            key = close_matches[0]
+
+        row = index[key]
+
+        #Until all country totals are needed, only the rows of the country are read and summed, once per country
+        if values is None:
+            values = self._country_total_rows
+            if row not in values:
+                values[row] = self._counts[self._country_rows(row)].sum(axis=0, dtype=np.int64)
+        return names[row], values[row]
+
+    def get_location_frame(self, location, data_location):
+        """Get a one row data frame of a location, in the same layout as the rows filtered from the CSV file by Covid19Data."""
+        import pandas as pd
+        name, values = self.find_location(location, data_location)
+        values = np.asarray(values)[np.newaxis, :]
+
+        if data_location == DataLocation.province_state:
+            row = self._province_index[name.casefold()]
+            df = pd.DataFrame(values, columns=self._date_columns)
+            df.insert(0, 'Long', self._long[row])
+            df.insert(0, 'Lat', self._lat[row])
+            df.insert(0, 'Country/Region', self.countries[row])
+            df.insert(0, 'Province/State', name)
+
+        #Country totals are indexed by country name, same as the groupby in Covid19Data
+        elif data_location == DataLocation.country_region:
+            lat, long = self._sum_by_country(np.c_[self._lat, self._long])[self._country_index[name.casefold()]]
+            df = pd.DataFrame(values, columns=self._date_columns, index=pd.Index([name], name='Country/Region'))
+            df.insert(0, 'Long', long)
+            df.insert(0, 'Lat', lat)
+
+        elif data_location == DataLocation.world:
+            df = pd.DataFrame(values, columns=self._date_columns)
+            df.insert(0, 'Long', self._long.sum())
+            df.insert(0, 'Lat', self._lat.sum())
+            df.insert(0, 'Country/Region', np.nan)
+            df.insert(0, 'Province/State', np.nan)
+
+        return name, df
+
+    def get_fit_sums(self):
+        """ Running sums of the log-linear fit over all dates, one row per location of get_location_matrix.
+
+        The sums are kept in the cache and updated with the new days only when the file gets new dates.
+
+        """
+        if self._fit_sums is None:
+            names, data_locations, matrix = self.get_location_matrix()
+            self._fit_sums = log_linear_sums(np.arange(1, matrix.shape[1]+1, dtype=float), log_cases(matrix))
+        return self._fit_sums
+
+    @timed_stage('select')
+    def get_location_matrix(self):
+        """ Get the case values of every province/state, every country/region total and the world total.
+
+        Returns:
+            List of location names, list of their DataLocation and a 2-D matrix with one row per location.
+
+        """
+        names = self.location_names(DataLocation.province_state) + list(self._country_names) + ['The World']
+        data_locations = [DataLocation.province_state] * len(self._province_rows) + \
+                         [DataLocation.country_region] * len(self._country_names) + [DataLocation.world]
+        matrix = np.vstack([self._counts[self._province_rows], self.country_totals, self.world_total])
+
+        return names, data_locations, matrix
+
+def batch_fit(dataset, start=None, end=None, snap=False, resamples=None, confidence=DEFAULT_CONFIDENCE, processes=1, quality=None):
+    """ Fit the log-linear model for every location of the dataset in one vectorized pass.
+
+    Parameters:
+        dataset
+            Covid19Dataset with the loaded time series
+        start, end
+            Optional start and end dates, same formats as the single location plot
+        snap
+            If True, dates not in the data are moved to the nearest available date
+        resamples
+            Number of bootstrap resamples, adds the standard error of the slope and the confidence intervals of the
+            slope, doubling time and R0 at the confidence level. None leaves them out
+        processes
+            Number of processes of the bootstrap of large location sets, None is the number of CPUs
+        quality
+            Policy of the data quality pass over all locations before the fit, see clean_cases. Adds the number of
+            revisions, zero days, spikes and changed days of every location. None skips the pass
+
+    Returns:
+        pandas DataFrame with one row of fit statistics per location
+
+    """
+    start_idx, end_idx = dataset.get_date_indices(start, end, snap)
+    names, data_locations, matrix = dataset.get_location_matrix()
+
+    report = None
+    if quality is not None:
+        values, report = clean_cases(matrix[:, start_idx:end_idx+1], quality)
+
+    with stage_timer('fit'):
+        intervals = None
+        #The whole history is fitted from the running sums
+        if start is None and end is None and not resamples and quality is None:
+            #The log of integer case values is flat when they are all equal, or all 0 or 1 (both have a log of 0)
+            low, high = matrix.min(axis=1), matrix.max(axis=1)
+            fit = fit_from_sums(*dataset.get_fit_sums().T, flat=(low == high) | ((low >= 0) & (high <= 1)))
+        else:
+            ln_y = log_cases(matrix[:, start_idx:end_idx+1] if report is None else values)
+            x = np.arange(1, ln_y.shape[1]+1, dtype=float)
+            if resamples:
+                fit, intervals = bootstrap_intervals(x, ln_y, resamples, confidence, processes=processes)
+            else:
+                fit = fit_log_linear(x, ln_y)
+
+    table = {
+        'location': names,
+        'data_location': [location.name for location in data_locations],
+        'start_date': dataset.date_columns[start_idx],
+        'end_date': dataset.date_columns[end_idx],
+        'slope': fit.slope,
+        'intercept': fit.intercept,
+        'r_squared': fit.r_squared,
+        'doubling_time': fit.doubling_time,
+        'r0': fit.r0,
+    }
+    if intervals is not None:
+        table['slope_stderr'] = fit.slope_stderr
+        table.update(intervals._asdict())
+    if report is not None:
+        table.update(revisions=report.revisions.sum(axis=1), zero_days=report.zeros.sum(axis=1),
+                     spikes=report.spikes.sum(axis=1), changed_days=report.changed.sum(axis=1))
+
+    import pandas as pd
+    return pd.DataFrame(table)
+
+class Covid19MultiDataset:
+    """Several COVID-19 time series files, e.g. confirmed, deaths and recovered, loaded in parallel processes and aligned.
+
+    The series keep only the locations (provinces/states, country/region totals and the world) and the dates that
+    are in every file, in the same order, so they can be fitted together in one pass.
+    """
+
+    def __init__(self, urls, cache=None, max_workers=None):
+        """ Constructor
+
+        Parameters:
+            urls
+                Dict of the series names and the URLs of their files, e.g. {'confirmed': ..., 'deaths': ...}
+            cache
+                Optional Covid19Cache shared by the files
+            max_workers
+                Number of processes loading the files, default is one per file up to the number of CPUs
+
+        """
+        self._urls = dict(urls)
+
+        #Files are loaded in processes, parsing with the csv module holds the GIL so threads would parse one file at a
+        #time. The loaded datasets are sent back pickled, which takes a few percent of the parsing time
+        max_workers = max_workers or min(len(self._urls), os.cpu_count() or 1)
+        with stage_timer('load'):
+            if max_workers == 1:
+                self._datasets = {name: Covid19Dataset(url, cache) for name, url in self._urls.items()}
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {name: executor.submit(Covid19Dataset, url, cache) for name, url in self._urls.items()}
+                    self._datasets = {name: future.result() for name, future in futures.items()}
+
+        #Dates and locations that are in every series
+        first = next(iter(self._datasets.values()))
+        self._dates = functools.reduce(np.intersect1d, [dataset.dates for dataset in self._datasets.values()])
+        self._date_columns = [first.date_columns[pos] for pos in np.searchsorted(first.dates, self._dates)]
+
+        location_matrices = {name: dataset.get_location_matrix() for name, dataset in self._datasets.items()}
+        keys = {name: list(zip(data_locations, names)) for name, (names, data_locations, matrix) in location_matrices.items()}
+        shared_keys = functools.reduce(lambda shared, other: shared & set(other), keys.values(), set(next(iter(keys.values()))))
+        self._locations = [key for key in next(iter(keys.values())) if key in shared_keys]
+
+        self._matrices = {}
+        for name, dataset in self._datasets.items():
+            positions = {key: row for row, key in enumerate(keys[name])}
+            rows = [positions[key] for key in self._locations]
+            self._matrices[name] = location_matrices[name][2][np.ix_(rows, np.searchsorted(dataset.dates, self._dates))]
+
+    @property
+    def series_names(self):
+        return list(self._matrices)
+
+    @property
+    def datasets(self):
+        return self._datasets
+
+    @property
+    def names(self):
+        return [name for data_location, name in self._locations]
+
+    @property
+    def data_locations(self):
+        return [data_location for data_location, name in self._locations]
+
+    @property
+    def dates(self):
+        return self._dates
+
+    @property
+    def date_columns(self):
+        return self._date_columns
+
+    def get_matrix(self, series):
+        """Aligned case values of a series, one row per location and one column per shared date."""
+        return self._matrices[series]
+
+    def get_date_indices(self, start, end, snap=False):
+        """Positions of the start and end dates in the shared dates, see get_date_range_indices."""
+        return get_date_range_indices(self._dates, start, end, snap)
+
+def multi_batch_fit(multi_dataset, start=None, end=None, snap=False, resamples=None, confidence=DEFAULT_CONFIDENCE, processes=1,
+                    quality=None):
+    """ Fit every series and location of a Covid19MultiDataset in one vectorized pass.
+
+    The log-linear fit of each series gives its slope, R squared, doubling time and R0, e.g. the doubling time of
+    deaths. With confirmed and deaths series, the linear trend of the case fatality rate (deaths / confirmed) is
+    fitted in the same pass.
+
+    Parameters:
+        resamples, confidence, processes, quality
+            Same as batch_fit, for every series. The case fatality rate is computed from the cleaned series, it has no
+            quality counts of its own
+
+    Returns:
+        pandas DataFrame with one row of fit statistics per location
+
+    """
+    start_idx, end_idx = multi_dataset.get_date_indices(start, end, snap)
+    series_names = multi_dataset.series_names
+    n_locations = len(multi_dataset.names)
+
+    values = {name: multi_dataset.get_matrix(name)[:, start_idx:end_idx+1] for name in series_names}
+    reports = {}
+    if quality is not None:
+        for name in series_names:
+            values[name], reports[name] = clean_cases(values[name], quality)
+
+    rows = [log_cases(values[name]) for name in series_names]
+    has_fatality_rate = 'confirmed' in series_names and 'deaths' in series_names
+    if has_fatality_rate:
+        confirmed = values['confirmed'].astype(float)
+        deaths = values['deaths']
+        #Days dropped from either series are left out of the rate too
+        fatality_rate = np.divide(deaths, confirmed, out=np.zeros_like(confirmed), where=confirmed > 0)
+        fatality_rate[np.isnan(confirmed) | np.isnan(deaths)] = np.nan
+        rows.append(fatality_rate)
+
+    with stage_timer('fit'):
+        stacked = np.vstack(rows)
+        x = np.arange(1, stacked.shape[1]+1, dtype=float)
+        intervals = None
+        if resamples:
+            fit, intervals = bootstrap_intervals(x, stacked, resamples, confidence, processes=processes)
+        else:
+            fit = fit_log_linear(x, stacked)
+
+    table = {
+        'location': multi_dataset.names,
+        'data_location': [location.name for location in multi_dataset.data_locations],
+        'start_date': multi_dataset.date_columns[start_idx],
+        'end_date': multi_dataset.date_columns[end_idx],
+    }
+    for idx, name in enumerate(series_names):
+        part = slice(idx * n_locations, (idx + 1) * n_locations)
+        table['%s_slope' % name] = fit.slope[part]
+        table['%s_r_squared' % name] = fit.r_squared[part]
+        table['%s_doubling_time' % name] = fit.doubling_time[part]
+        table['%s_r0' % name] = fit.r0[part]
+        if intervals is not None:
+            table['%s_slope_stderr' % name] = fit.slope_stderr[part]
+            for field, bounds in intervals._asdict().items():
+                table['%s_%s' %(name, field)] = bounds[part]
+        if name in reports:
+            report = reports[name]
+            table['%s_revisions' % name] = report.revisions.sum(axis=1)
+            table['%s_zero_days' % name] = report.zeros.sum(axis=1)
+            table['%s_spikes' % name] = report.spikes.sum(axis=1)
+            table['%s_changed_days' % name] = report.changed.sum(axis=1)
+
+    #Slope of the case fatality rate is its change per day
+    if has_fatality_rate:
+        table['case_fatality_rate'] = fatality_rate[:, -1]
+        table['case_fatality_slope'] = fit.slope[-n_locations:]
+        table['case_fatality_r_squared'] = fit.r_squared[-n_locations:]
+
+    import pandas as pd
+    return pd.DataFrame(table)
+
+def rolling_window_fit(dataset, location, data_location, window, step=1, start=None, end=None, snap=False):
+    """ Fit the log-linear model of one location over every window of window days between the start and end dates.
+
+    Returns:
+        pandas DataFrame with the dates and fit statistics of each window
+
+    """
+    with stage_timer('select'):
+        name, values = dataset.find_location(location, data_location)
+    start_idx, end_idx = dataset.get_date_indices(start, end, snap)
+    with stage_timer('fit'):
+        starts, fit = rolling_fit(log_cases(values[start_idx:end_idx+1]), window, step)
+    starts = starts + start_idx
+
+    import pandas as pd
+    return pd.DataFrame({
+        'location': name,
+        'start_date': [dataset.date_columns[idx] for idx in starts],
+        'end_date': [dataset.date_columns[idx + window - 1] for idx in starts],
+        'slope': fit.slope[0],
+        'r_squared': fit.r_squared[0],
+        'doubling_time': fit.doubling_time[0],
+        'r0': fit.r0[0],
+    })
+
+def plot_rolling_fit(rolling_fits, window):
+    """Line plot of the slope and doubling time of each window, dated by the last day of the window."""
+    import matplotlib.pyplot as plt
+    location = rolling_fits['location'].iloc[0]
+    end_dates = parse_csv_dates(rolling_fits['end_date'])
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True, figsize=(10, 6))
+    ax1.plot(end_dates, rolling_fits['slope'], '-r')
+    ax1.set_ylabel('Slope $b$ day$^{-1}$')
+    ax1.grid()
+
+    #Doubling times of flat or falling windows are infinite or negative, they are left out of the plot
+    doubling_time = rolling_fits['doubling_time'].where(rolling_fits['doubling_time'] > 0)
+    ax2.plot(end_dates, doubling_time, '-', color='#FFA500')
+    ax2.set_ylabel('Doubling time (days)')
+    ax2.set_xlabel('Last day of the %d day window' % window)
+    ax2.grid()
+
+    fig.autofmt_xdate()
+    fig.suptitle('COVID-19 Epidemic in %s\nRolling %d day linear fit of log cases' %(location, window), fontsize=14)
+    plt.show()
+
+class _LRUCache:
+    """Least recently used cache of a limited number of entries, safe to use from several threads."""
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Values of the query flags snap and world, a missing flag is False
+QUERY_FLAG_VALUES = {'1': True, 'true': True, 'yes': True, 'on': True,
+                     '': False, '0': False, 'false': False, 'no': False, 'off': False}
+
+def _parse_query_flag(query, name):
+    """Value of a flag of a request query as a bool, raises ValueError for a value that is not a flag value."""
+    value = query.get(name, '').strip().lower()
+    if value not in QUERY_FLAG_VALUES:
+        raise ValueError('The %s parameter should be 1 or 0 (true or false), not %s' %(name, query[name]))
+    return QUERY_FLAG_VALUES[value]
+
+class Covid19Server:
+    """Local HTTP service keeping the dataset and its location and date indexes warm in memory.
+
+    Endpoints, with a location given as province=..., country=... or world=1 and optional start, end and snap=1:
+        /fit        fit statistics as JSON, e.g. /fit?country=Italy&start=3/21/20&end=4/5/20
+        /plot       the plot as PNG
+        /locations  names of the provinces/states and countries/regions as JSON
+
+    Fit results and plots are kept in least recently used caches. A background thread checks the data file
+    every reload_interval seconds and loads it again when it changed, then the caches are cleared.
+    """
+
+    def __init__(self, url, cache=None, max_cached_fits=1024, max_cached_plots=128, reload_interval=60):
+        """Constructor"""
+        self._url = url
+        self._cache = cache
+        self._reload_interval = reload_interval
+        self._fits = _LRUCache(max_cached_fits)
+        self._plots = _LRUCache(max_cached_plots)
+
+        #The dataset and its generation are replaced together, the generation is part of the cache keys so fits of
+        #requests that started before a reload are never served from the caches after it
+        self._signature = self._get_source_signature()
+        self._loaded = (0, Covid19Dataset(url, cache))
+
+        #A figure is not thread-safe, requests draw one plot at a time with the same renderer
+        self._renderer = Covid19PlotRenderer()
+        self._render_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def dataset(self):
+        return self._loaded[1]
+
+    def _get_source_signature(self):
+        """Modification time and size of a local file, or the ETag / Last-Modified of a web URL."""
+        if self._url.startswith(('http://', 'https://')):
+            return Covid19Cache.get_remote_validator(self._url)
+        stat = os.stat(os.path.join(self._url, COLUMNAR_MANIFEST) if is_columnar_dataset(self._url) else self._url)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload_if_changed(self):
+        """Load the data file again if it changed, returns True if it was reloaded."""
+        signature = self._get_source_signature()
+        if signature is None or signature == self._signature:
+            return False
+
+        #The new dataset is loaded before replacing the old one, requests are served from the old one meanwhile
+        dataset = Covid19Dataset(self._url, self._cache)
+        self._loaded, self._signature = (self._loaded[0] + 1, dataset), signature
+        self._fits.clear()
+        self._plots.clear()
+        return True
+
+    def _watch_source(self):
+        while not self._stop.wait(self._reload_interval):
+            try:
+                if self.reload_if_changed():
+                    print('Reloaded %s' % self._url)
+            except (OSError, ValueError) as e:
+                print('Could not reload %s: %s' %(self._url, e))
+
+    def _get_location_fit(self, query):
+        """Fit of the location and dates of a query, cached by the dataset generation and the query parameters."""
+        generation, dataset = self._loaded
+        if query.get('province'):
+            location, data_location = query['province'], DataLocation.province_state
+        elif query.get('country'):
+            location, data_location = query['country'], DataLocation.country_region
+        elif _parse_query_flag(query, 'world'):
+            location, data_location = 'The World', DataLocation.world
+        else:
+            raise ValueError('Please provide a province, country or world=1 parameter')
+
+        snap = _parse_query_flag(query, 'snap')
+        key = (data_location, location.casefold(), query.get('start'), query.get('end'), snap, generation)
+        location_fit = self._fits.get(key)
+        if location_fit is None:
+            start_idx, end_idx = dataset.get_date_indices(query.get('start'), query.get('end'), snap)
+            location_fit = fit_location(dataset, location, data_location, start_idx, end_idx)
+            self._fits.put(key, location_fit)
+        return key, location_fit
+
+    def handle(self, path):
+        """ Answer a request path with its query string.
+
+        Returns:
+            Tuple of the HTTP status, the content type and the body bytes
+
+        """
+        request = urllib.parse.urlsplit(path)
+        query = {name: values[-1] for name, values in urllib.parse.parse_qs(request.query).items()}
+
+        try:
+            if request.path == '/locations':
+                names = {data_location.name: self.dataset.location_names(data_location) for data_location in DataLocation}
+                return 200, 'application/json', json.dumps(names).encode('utf-8')
+
+            elif request.path == '/fit':
+                key, location_fit = self._get_location_fit(query)
+                body = get_location_fit_stats(location_fit, key[0])
+                return 200, 'application/json', json.dumps(body).encode('utf-8')
+
+            elif request.path == '/plot':
+                key, location_fit = self._get_location_fit(query)
+                image = self._plots.get(key)
+                if image is None:
+                    buffer = io.BytesIO()
+                    with self._render_lock:
+                        draw_location_fit(self._renderer, location_fit)
+                        self._renderer.save(buffer, 'png')
+                    image = buffer.getvalue()
+                    self._plots.put(key, image)
+                return 200, 'image/png', image
+
+            return 404, 'application/json', json.dumps({'error': 'Unknown path %s' % request.path}).encode('utf-8')
+
+        except KeyError as e:
+            return 404, 'application/json', json.dumps({'error': e.args[0]}).encode('utf-8')
+        except ValueError as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode('utf-8')
+
+    def serve(self, host='127.0.0.1', port=8000):
+        """Serve requests until interrupted, each request runs in its own thread."""
+        import http.server
+        covid19_server = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = covid19_server.handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        watcher = threading.Thread(target=self._watch_source, daemon=True)
+        watcher.start()
+        httpd = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+        print('Serving COVID-19 fits on http://%s:%d' %(host, port))
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            httpd.server_close()
+
+
+class _LocationAction(argparse.Action):
+    """Argument action of -p, -c and -w, also appends (name, DataLocation) to args.locations in the command line order."""
+
+    def __init__(self, option_strings, dest, data_location=None, **kwargs):
+        super().__init__(option_strings, dest, **kwargs)
+        self.data_location = data_location
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        #-w takes no value, it is given once
+        name = self.const if self.nargs == 0 else values
+        if self.nargs == 0:
+            if getattr(namespace, self.dest) is not None:
+                return
+            setattr(namespace, self.dest, name)
+        else:
+            setattr(namespace, self.dest, (getattr(namespace, self.dest) or []) + [name])
+        namespace.locations = (namespace.locations or []) + [(name, self.data_location)]
 
 def main():
 
@@ -418,15 +2484,21 @@ def main():
         parser.add_argument('-p',
                             '--province_state',
                             type=str,
-                            help='Name of province or state to obtain the COVID-19 data')
+                            action=_LocationAction,
+                            data_location=DataLocation.province_state,
+                            help='Name of province or state to obtain the COVID-19 data, give it several times (also with -c or -w) to compare locations on one plot')
         parser.add_argument('-c',
                             '--country_region',
                             type=str,
-                            help='Name of country or region to obtain the COVID-19 data')
+                            action=_LocationAction,
+                            data_location=DataLocation.country_region,
+                            help='Name of country or region to obtain the COVID-19 data, give it several times (also with -p or -w) to compare locations on one plot')
         parser.add_argument('-w',
                             '--world',
-                            action='store_const',
+                            action=_LocationAction,
+                            nargs=0,
                             const = 'The World',
+                            data_location=DataLocation.world,
                             help='The entire world')
         parser.add_argument('-u',
                             '--url',
@@ -440,8 +2512,169 @@ def main():
                             '--end_date',
                             type=str,
                             help='End date in the COVID-19 data, can be entered as M-DD-YY such as 1-31-20 for January 31, 2020')    
+        parser.add_argument('--deaths-url',
+                            type=str,
+                            help='URL of the COVID-19 deaths data file, used with --batch to also fit deaths and the case fatality rate')
+        parser.add_argument('--recovered-url',
+                            type=str,
+                            help='URL of the COVID-19 recovered data file, used with --batch to also fit recoveries')
+        parser.add_argument('--snap-dates',
+                            action='store_true',
+                            help='Move start and end dates that are not in the COVID-19 data to the nearest available date')
+        parser.add_argument('-b',
+                            '--batch',
+                            type=str,
+                            help='Fit every province/state, country/region and the world, and write the results table to this CSV file')
+        parser.add_argument('--window',
+                            type=int,
+                            help='Fit every window of this many days of the location and show how the slope and doubling time changed, not with --quality or --resamples')
+        parser.add_argument('--step',
+                            type=int,
+                            default=1,
+                            help='Number of days between the starts of two windows, used with --window')
+        parser.add_argument('-o',
+                            '--output-dir',
+                            type=str,
+                            help='Save the plots to this directory instead of showing them. Without a location, the plots of every province/state, country/region and the world are saved')
+        parser.add_argument('--format',
+                            choices=['png', 'svg'],
+                            default='png',
+                            help='Image format of the saved plots, used with --output-dir')
+        parser.add_argument('--processes',
+                            type=int,
+                            help='Number of processes rendering the saved plots or bootstrapping large location sets with --batch, default is the number of CPUs')
+        parser.add_argument('--resamples',
+                            type=int,
+                            help='Number of bootstrap resamples of the confidence intervals of the slope, doubling time and R0, default is %d for a location, 0 leaves them out. '
+                                 'With --batch, the intervals and the standard error of the slope are only added when given' % DEFAULT_RESAMPLES)
+        parser.add_argument('--confidence',
+                            type=float,
+                            default=DEFAULT_CONFIDENCE,
+                            help='Confidence level of the confidence intervals, default is %s' % DEFAULT_CONFIDENCE)
+        parser.add_argument('--no-plot',
+                            action='store_true',
+                            help='Print the slope, R squared, doubling time and R0 of the location without plotting, matplotlib and Pandas are not loaded')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='Print the fit statistics of the location as JSON without plotting, e.g. for scripts and shell pipelines')
+        parser.add_argument('--serve',
+                            type=int,
+                            nargs='?',
+                            const=8000,
+                            metavar='PORT',
+                            help='Serve fit statistics (/fit) and plots (/plot) of the data file over HTTP on this port, default 8000')
+        parser.add_argument('--host',
+                            type=str,
+                            default='127.0.0.1',
+                            help='Address the HTTP server listens on, used with --serve')
+        parser.add_argument('--reload-interval',
+                            type=float,
+                            default=60,
+                            help='Seconds between checks of the data file for changes, used with --serve')
+        parser.add_argument('--stream',
+                            action='store_true',
+                            help='Read the data file in chunks and keep only the rows of the locations and the dates between the start and end dates, for files too large to load such as the US county files')
+        parser.add_argument('--quality',
+                            choices=QUALITY_POLICIES,
+                            help='Data quality pass before the fit: flag downward revisions, days with zero cases and one-day spikes, report them and '
+                                 'leave them as they are (none), leave them out of the fit (drop), clip the series to never decrease (clip) or interpolate them (interpolate)')
+        parser.add_argument('--export',
+                            type=str,
+                            metavar='DIR',
+                            help='Convert the data file of --url to memory-mapped columnar files (.npy and a JSON manifest) in this directory. Use the directory as --url to open it without parsing')
+        parser.add_argument('--export-csv',
+                            type=str,
+                            metavar='FILE',
+                            help='Write the data of --url, e.g. an exported directory, to this CSV file in the Johns Hopkins layout')
+        parser.add_argument('--cache-dir',
+                            type=str,
+                            default=DEFAULT_CACHE_DIR,
+                            help='Directory of the parsed data cache, default is %s' % DEFAULT_CACHE_DIR)
+        parser.add_argument('--no-cache',
+                            action='store_true',
+                            help='Always download and parse the data file, do not use the parsed data cache')
+        parser.add_argument('--timings',
+                            type=str,
+                            metavar='FILE',
+                            help='Record the wall time of the load, select, dates, slice, quality, fit and render stages and write them as JSON to this file, - prints them')
+        parser.add_argument('--trace-memory',
+                            action='store_true',
+                            help='Also record the peak memory of the stages with --timings. Tracing slows the stages unevenly, e.g. the CSV parsing several times, so time without it')
+        parser.add_argument('--profile',
+                            type=str,
+                            metavar='FILE',
+                            help='Profile the run with cProfile and write the statistics to this file, e.g. to view with python -m pstats FILE')
+        parser.set_defaults(locations=None)
         args = parser.parse_args()
 
+        timings = Covid19Timings(trace_memory=args.trace_memory) if args.timings else None
+        profiler = cProfile.Profile() if args.profile else None
+
+        with timings or contextlib.nullcontext():
+            if profiler is not None:
+                profiler.enable()
+            try:
+                run(args)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(args.profile)
+
+        if timings is not None:
+            if args.timings == '-':
+                print(timings.to_json())
+            else:
+                with open(args.timings, 'w') as f:
+                    f.write(timings.to_json())
+
+def run(args):
+        """Run the command line arguments parsed by main."""
+        cache = None if args.no_cache else Covid19Cache(args.cache_dir)
+
+        if args.serve and args.url:
+            Covid19Server(args.url, cache, reload_interval=args.reload_interval).serve(args.host, args.serve)
+            return
+
+        if (args.export or args.export_csv) and args.url:
+            dataset = Covid19Dataset(args.url, cache)
+            if args.export:
+                dataset.export(args.export)
+                print('Exported %d rows and %d dates to %s' %(dataset.counts.shape[0], dataset.counts.shape[1], args.export))
+            if args.export_csv:
+                dataset.to_dataframe().to_csv(args.export_csv, index=False)
+                print('Wrote %d rows and %d dates to %s' %(dataset.counts.shape[0], dataset.counts.shape[1], args.export_csv))
+            return
+
+        if args.batch and args.url:
+            try:
+                if args.deaths_url or args.recovered_url:
+                    urls = {'confirmed': args.url, 'deaths': args.deaths_url, 'recovered': args.recovered_url}
+                    multi_dataset = Covid19MultiDataset({name: url for name, url in urls.items() if url}, cache)
+                    results = multi_batch_fit(multi_dataset, args.start_date, args.end_date, args.snap_dates, args.resamples, args.confidence,
+                                              args.processes, args.quality)
+                else:
+                    dataset = Covid19Dataset(args.url, cache)
+                    results = batch_fit(dataset, args.start_date, args.end_date, args.snap_dates, args.resamples, args.confidence, args.processes,
+                                        args.quality)
+            except ValueError as e:
+                print(e)
+                return
+            results.to_csv(args.batch, index=False)
+            print('Wrote fit statistics of %d locations to %s' %(len(results), args.batch))
+            return
+
+        if args.output_dir and args.url and not (args.province_state or args.country_region or args.world):
+            dataset = Covid19Dataset(args.url, cache)
+            locations = [(name, data_location) for data_location in DataLocation for name in dataset.location_names(data_location)]
+            try:
+                paths = render_locations(dataset, locations, args.output_dir, args.format, args.start_date, args.end_date,
+                                         args.snap_dates, args.processes)
+            except ValueError as e:
+                print(e)
+                return
+            print('Saved %d plots to %s' %(len(paths), args.output_dir))
+            return
+
         if not (args.province_state or args.country_region or args.world) or not args.url:
             print('Please provide a URL of the data file plus location (province, state, region, or country, or type w for the world,).')
             print('Instructions are available by typing: python covid19_linear_plot.py --help')
@@ -453,16 +2686,101 @@ def main():
             start_date = args.start_date
         if args.end_date:
             end_date = args.end_date
-        if args.province_state and args.url:
-            data = Covid19Data(args.province_state, args.url, DataLocation.province_state)
-        elif args.country_region and args.url:
-            data = Covid19Data(args.country_region, args.url, DataLocation.country_region)
-        elif args.world and args.url:
-            data = Covid19Data(args.world, args.url, DataLocation.world)
-
-        start_and_end_dates = data.set_start_end_dates(start_date, end_date)
+        #Locations in the order given on the command line
+        locations = list(args.locations)
+
+        #The windows are fitted from running sums over the days, which have no days left out and no resamples
+        if args.window and (args.quality is not None or args.resamples):
+            print('--quality and --resamples cannot be used with --window, leave them out or fit the dates without --window.')
+            return
+
+        #Only the rows of the locations and the dates between the start and end dates are read from the file
+        if args.stream:
+            try:
+                table = stream_time_series_csv(args.url, locations, start_date, end_date, args.snap_dates)
+            except (KeyError, ValueError) as e:
+                print(e.args[0])
+                return
+            dataset = Covid19Dataset(args.url, table=table)
+        else:
+            dataset = Covid19Dataset(args.url, cache)
+
+        if args.window:
+            location, data_location = locations[0]
+            try:
+                rolling_fits = rolling_window_fit(dataset, location, data_location, args.window, args.step, start_date, end_date, args.snap_dates)
+            except (KeyError, ValueError) as e:
+                print(e.args[0])
+                return
+            print(rolling_fits.to_string(index=False))
+            if not (args.no_plot or args.json):
+                plot_rolling_fit(rolling_fits, args.window)
+            return
+
+        #Several locations are fitted together and compared on one plot
+        if len(locations) > 1:
+            try:
+                start_idx, end_idx = dataset.get_date_indices(start_date, end_date, args.snap_dates)
+                location_fits, report = fit_locations(dataset, locations, start_idx, end_idx, args.quality)
+            except (KeyError, ValueError) as e:
+                print(e.args[0])
+                return
+            for row, (location_fit, (location, data_location)) in enumerate(zip(location_fits, locations)):
+                fit = location_fit.fit
+                if args.json:
+                    print(json.dumps(get_location_fit_stats(location_fit, data_location)))
+                else:
+                    print('%s: Slope value %.3f, R Squared Value %.3f, Doubling time %.2f, R0 Value %.2f'
+                          %(location_fit.name, fit.slope, fit.r_squared, fit.doubling_time, fit.r0))
+                    if report is not None:
+                        print('    ' + describe_quality_report(report, dataset.date_columns[start_idx:], args.quality, row))
+            if args.no_plot or args.json:
+                return
+
+            start_date_label = get_readable_date(location_fits[0].start_date)
+            end_date_label = get_readable_date(location_fits[0].end_date)
+            if args.output_dir:
+                os.makedirs(args.output_dir, exist_ok=True)
+                output_path = os.path.join(args.output_dir, 'comparison.%s' % args.format)
+                renderer = Covid19ComparisonRenderer()
+                renderer.draw(location_fits, start_date_label, end_date_label)
+                renderer.save(output_path)
+                print('Saved plot to %s' % output_path)
+            else:
+                import matplotlib.pyplot as plt
+                renderer = Covid19ComparisonRenderer(plt.figure(figsize=(14,10)))
+                renderer.draw(location_fits, start_date_label, end_date_label)
+                plt.show()
+            return
+
+        location, data_location = locations[0]
+        try:
+            data = Covid19Data(location, args.url, data_location, dataset=dataset)
+        except KeyError as e:
+            print(e.args[0])
+            return
+
+        start_and_end_dates = data.set_start_end_dates(start_date, end_date, args.snap_dates)
+        if start_and_end_dates is None:
+            return
         x_y_dates = data.get_covid19_data(start_and_end_dates)
-        data.plot(x_y_dates)
+        if args.quality is not None:
+            x_y_dates, report = data.clean(x_y_dates, args.quality)
+            if not args.json:
+                print(data.get_quality_description(x_y_dates, report, args.quality))
+            if np.count_nonzero(np.isfinite(x_y_dates.y01_plot_data)) < 2:
+                print('Fewer than 2 days are left after the data quality pass, there is no line to fit. Try a longer time period or another --quality policy.')
+                return
+        resamples = DEFAULT_RESAMPLES if args.resamples is None else args.resamples
+        if args.no_plot or args.json:
+            data.print_stats(x_y_dates, args.json, resamples, args.confidence)
+        elif args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            output_path = os.path.join(args.output_dir, '%s.%s' %(re.sub(r'[^\w.-]+', '_', data.location), args.format))
+            data.plot(x_y_dates, output_path, resamples, args.confidence)
+            print('Saved plot to %s' % output_path)
+        else:
+            data.plot(x_y_dates, resamples=resamples, confidence=args.confidence)
 
 if __name__ == '__main__':
     main()
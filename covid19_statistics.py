@@ -0,0 +1,220 @@
+import numpy as np
+import collections
+import concurrent.futures
+"""
+
+Fit Statistics of the COVID-19 Linear Plot Tool
+
+Closed-form least squares fit of the natural log of the case values against the day number, for one location or
+many locations at once (one row each), with the R squared, the standard error of the slope and bootstrap confidence
+intervals of the slope, doubling time and daily R0. Only numpy is needed, so the statistics can be used without
+matplotlib and Pandas.
+
+"""
+
+# Fit of every row of ln_y, each field is an array with one value per row
+FitStatistics = collections.namedtuple('FitStatistics', ['slope', 'intercept', 'r_squared', 'slope_stderr', 'doubling_time', 'r0'])
+
+# Lower and upper bounds of the bootstrap confidence intervals, each field is an array with one value per row
+ConfidenceIntervals = collections.namedtuple('ConfidenceIntervals', ['slope_low', 'slope_high', 'doubling_time_low', 'doubling_time_high',
+                                                                     'r0_low', 'r0_high'])
+
+DEFAULT_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+
+# Number of rows bootstrapped together, larger location sets are split in chunks of this size
+DEFAULT_CHUNK_ROWS = 4096
+
+def _fit(x, ln_y):
+    """Closed-form fit of every row of ln_y, returns the FitStatistics, the residuals and the centered days.
+
+    When ln_y has NaN days the centered days are a matrix with one row per row of ln_y, see _fit_missing_days.
+    """
+    x = np.asarray(x, dtype=float)
+    ln_y = np.atleast_2d(np.asarray(ln_y, dtype=float))
+    valid = np.isfinite(ln_y)
+    if not valid.all():
+        return _fit_missing_days(x, ln_y, valid)
+    n_days = x.size
+
+    x_mean = x.mean()
+    x_dev = x - x_mean
+    sum_xx = x_dev.dot(x_dev)
+    y_mean = ln_y.mean(axis=1)
+
+    slope = ln_y.dot(x_dev) / sum_xx
+    intercept = y_mean - slope * x_mean
+
+    # R squared with the same definition as Covid19Data.coeff_determination
+    residuals = ln_y - (slope[:, np.newaxis] * x + intercept[:, np.newaxis])
+    squared_error_regr = np.einsum('ij,ij->i', residuals, residuals)
+    y_dev = ln_y - y_mean[:, np.newaxis]
+    squared_error_y_mean = np.einsum('ij,ij->i', y_dev, y_dev)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = 1 - squared_error_regr / squared_error_y_mean
+        doubling_time = np.log(2.) / slope
+        #Standard error of the slope has n - 2 degrees of freedom, undefined for fewer than 3 days
+        slope_stderr = np.sqrt(squared_error_regr / (n_days - 2) / sum_xx) if n_days > 2 else np.full_like(slope, np.nan)
+
+    return FitStatistics(slope, intercept, r_squared, slope_stderr, doubling_time, np.exp(slope) - 1), residuals, x_dev
+
+def _fit_missing_days(x, ln_y, valid):
+    """ Closed-form fit of every row of ln_y over its valid days, all rows in one pass.
+
+    The sums of every row are taken over its valid days only, the missing days have 0 residuals and 0 centered days.
+    Rows with fewer than 2 valid days have no fit (NaN).
+    """
+    y = np.where(valid, ln_y, 0.0)
+    n = valid.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = valid.dot(x) / n
+        y_mean = y.sum(axis=1) / n
+        x_dev = np.where(valid, x - x_mean[:, np.newaxis], 0.0)
+        sum_xx = np.einsum('ij,ij->i', x_dev, x_dev)
+
+        #The centered days of a row sum to 0, so the sum of x_dev * y is the sum of x_dev * (y - y_mean)
+        slope = np.einsum('ij,ij->i', x_dev, y) / sum_xx
+        intercept = y_mean - slope * x_mean
+
+        residuals = np.where(valid, ln_y - (slope[:, np.newaxis] * x + intercept[:, np.newaxis]), 0.0)
+        squared_error_regr = np.einsum('ij,ij->i', residuals, residuals)
+        y_dev = np.where(valid, ln_y - y_mean[:, np.newaxis], 0.0)
+        squared_error_y_mean = np.einsum('ij,ij->i', y_dev, y_dev)
+
+        r_squared = 1 - squared_error_regr / squared_error_y_mean
+        doubling_time = np.log(2.) / slope
+        slope_stderr = np.where(n > 2, np.sqrt(squared_error_regr / (n - 2) / sum_xx), np.nan)
+
+    return FitStatistics(slope, intercept, r_squared, slope_stderr, doubling_time, np.exp(slope) - 1), residuals, x_dev
+
+def fit_statistics(x, ln_y):
+    """ Least squares fit of ln_y = slope * x + intercept, for many locations at once.
+
+    Parameters:
+        x
+            1-D array of the day numbers, e.g. 1, 2, 3, ...
+        ln_y
+            Natural log of the case values, 1-D for one location or 2-D with one row per location. Days that are NaN,
+            e.g. dropped by a data quality pass, are left out of the fit of their row.
+
+    Returns:
+        FitStatistics with slope, intercept, R squared, standard error of the slope, doubling time and daily R0 arrays
+
+    """
+    return _fit(x, ln_y)[0]
+
+def bootstrap_weights(x_dev, resamples=DEFAULT_RESAMPLES, seed=0):
+    """ Draw the residual resamples of the bootstrap as one (resamples x days) matrix.
+
+    Each resample adds the residuals drawn with replacement to the fitted line. Its slope is the fitted slope plus the
+    drawn residuals times the centered days, divided by the sum of squares of the centered days, so the draws are kept
+    as the sum of the centered days each day's residual was drawn for. The slopes of every location and resample are
+    then a single matrix product with the residuals.
+
+    Parameters:
+        x_dev
+            Days minus their mean
+        resamples
+            Number of bootstrap resamples
+        seed
+            Seed of the random draws, None for different draws on every call
+
+    Returns:
+        Array of shape (resamples, days)
+
+    """
+    x_dev = np.asarray(x_dev, dtype=float)
+    n_days = x_dev.size
+    draws = np.random.default_rng(seed).integers(0, n_days, size=(resamples, n_days))
+
+    #Add the centered day of every draw to the column of the drawn day, in one bincount over the flattened matrix
+    flat_index = (np.arange(resamples)[:, np.newaxis] * n_days + draws).ravel()
+    weights = np.bincount(flat_index, weights=np.broadcast_to(x_dev, draws.shape).ravel(), minlength=resamples * n_days)
+    return weights.reshape(resamples, n_days) / x_dev.dot(x_dev)
+
+def wild_bootstrap_signs(n_days, resamples=DEFAULT_RESAMPLES, seed=0):
+    """ Draw the random signs of a wild bootstrap as one (resamples x days) matrix of -1 and 1.
+
+    Each resample keeps the residual of every day and flips its sign at random. Unlike bootstrap_weights, the draws
+    do not depend on the days, so rows fitted over different days share them and stay a single matrix product.
+    """
+    return np.random.default_rng(seed).integers(0, 2, size=(resamples, n_days)) * 2.0 - 1.0
+
+def _bootstrap_slope_quantiles(slope, residuals, weights, quantiles):
+    """Quantiles of the bootstrap slopes of every row, run in the worker processes of bootstrap_intervals."""
+    slopes = slope[:, np.newaxis] + residuals.dot(weights.T)
+    return np.quantile(slopes, quantiles, axis=1).T
+
+def bootstrap_intervals(x, ln_y, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, seed=0, processes=1,
+                        chunk_rows=DEFAULT_CHUNK_ROWS):
+    """ Fit statistics and percentile bootstrap confidence intervals of the slope, doubling time and daily R0.
+
+    The days are kept and the residuals of the fit are resampled with replacement. All locations share the same
+    resamples, see bootstrap_weights, so the intervals do not depend on how the rows are split between processes.
+    Rows with NaN days, e.g. dropped by a data quality pass, are fitted over their other days and resampled with a
+    wild bootstrap instead, see wild_bootstrap_signs, as their days differ from row to row.
+
+    Parameters:
+        x, ln_y
+            Days and natural log of the case values, same as fit_statistics
+        resamples
+            Number of bootstrap resamples
+        confidence
+            Confidence level of the intervals, e.g. 0.95
+        seed
+            Seed of the resamples, the same seed gives the same intervals. None for different resamples on every call
+        processes
+            Number of processes, chunks of chunk_rows rows are bootstrapped in parallel. None is the number of CPUs
+        chunk_rows
+            Number of rows bootstrapped together
+
+    Returns:
+        Tuple of the FitStatistics and the ConfidenceIntervals. The doubling time interval follows from the slope
+        interval, its upper bound is infinite when the slope interval includes 0, and both bounds are NaN when the
+        whole slope interval is negative (the cases are not doubling).
+
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('The confidence level %s must be between 0 and 1' % confidence)
+
+    x = np.asarray(x, dtype=float)
+    ln_y = np.atleast_2d(np.asarray(ln_y, dtype=float))
+    n_rows = ln_y.shape[0]
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    fit, residuals, x_dev = _fit(x, ln_y)
+
+    #Complete rows share the centered days and the residual resamples, the slopes of the resamples of the other rows
+    #are their slope plus the sum of their centered days times their residuals with random signs
+    parts = []
+    complete = np.isfinite(ln_y).all(axis=1)
+    if complete.any():
+        parts.append((np.flatnonzero(complete), residuals[complete], bootstrap_weights(x - x.mean(), resamples, seed)))
+    if not complete.all():
+        rows = np.flatnonzero(~complete)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = x_dev[rows] * residuals[rows] / np.einsum('ij,ij->i', x_dev[rows], x_dev[rows])[:, np.newaxis]
+        parts.append((rows, terms, wild_bootstrap_signs(x.size, resamples, seed)))
+
+    chunks = [(rows[start:start + chunk_rows], fit.slope[rows[start:start + chunk_rows]], terms[start:start + chunk_rows], weights)
+              for rows, terms, weights in parts for start in range(0, len(rows), chunk_rows)]
+
+    if processes == 1 or n_rows <= chunk_rows:
+        slope_bounds = [_bootstrap_slope_quantiles(slope, residuals, weights, quantiles) for rows, slope, residuals, weights in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            slope_bounds = list(executor.map(_bootstrap_slope_quantiles, *zip(*[chunk[1:] + (quantiles,) for chunk in chunks])))
+
+    slope_low = np.full(n_rows, np.nan)
+    slope_high = np.full(n_rows, np.nan)
+    for (rows, slope, residuals, weights), bounds in zip(chunks, slope_bounds):
+        slope_low[rows], slope_high[rows] = bounds.T
+
+    #Doubling time and R0 are monotonic in the slope, their bounds are the bounds of the slope transformed
+    with np.errstate(divide='ignore'):
+        doubling_time_low = np.where(slope_high > 0, np.log(2.) / slope_high, np.nan)
+        doubling_time_high = np.where(slope_high > 0, np.where(slope_low > 0, np.log(2.) / slope_low, np.inf), np.nan)
+
+    return fit, ConfidenceIntervals(slope_low, slope_high, doubling_time_low, doubling_time_high,
+                                    np.exp(slope_low) - 1, np.exp(slope_high) - 1)
@@ -0,0 +1,347 @@
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import covid19_linear_plot as covid19
+from covid19_linear_plot import Covid19Cache, Covid19Dataset
+"""
+
+Tests of the COVID-19 Linear Plot Tool, run with python -m pytest from the repository directory
+
+"""
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'time_series_covid19_confirmed_global.csv')
+
+@pytest.fixture(scope='module')
+def data_frame():
+    return pd.read_csv(DATA_FILE)
+
+def test_append_new_dates_detects_revised_history(data_frame, tmp_path):
+    """A file with a new date and a revised earlier day is parsed again instead of appended to the cached data."""
+    path = str(tmp_path / 'confirmed.csv')
+    cache = Covid19Cache(str(tmp_path / 'cache'))
+
+    #Cache the file without its last 2 dates
+    data_frame.iloc[:, :-2].to_csv(path, index=False)
+    Covid19Dataset(path, cache)
+
+    #The file gets 1 more date and a revision of an earlier day
+    revised = data_frame.iloc[:, :-1].copy()
+    revised.iloc[10, 20] += 5
+    revised.to_csv(path, index=False)
+
+    dataset = Covid19Dataset(path, cache)
+    fresh = Covid19Dataset(path)
+    np.testing.assert_array_equal(dataset.counts, fresh.counts)
+    np.testing.assert_allclose(dataset.get_fit_sums(), fresh.get_fit_sums())
+    pd.testing.assert_frame_equal(covid19.batch_fit(dataset), covid19.batch_fit(fresh))
+
+    #The cached entry has the revised values too
+    np.testing.assert_array_equal(Covid19Dataset(path, cache).counts, fresh.counts)
+
+def test_append_new_dates(data_frame, tmp_path, monkeypatch):
+    """A file that only gets new dates is appended to the cached data without parsing it again, with the same fit as a fresh parse."""
+    path = str(tmp_path / 'confirmed.csv')
+    cache = Covid19Cache(str(tmp_path / 'cache'))
+    data_frame.iloc[:, :-2].to_csv(path, index=False)
+    Covid19Dataset(path, cache).get_fit_sums()
+
+    data_frame.to_csv(path, index=False)
+    with monkeypatch.context() as patch:
+        patch.setattr(covid19, 'read_time_series_csv', None)
+        dataset = Covid19Dataset(path, cache)
+    fresh = Covid19Dataset(path)
+    np.testing.assert_array_equal(dataset.counts, fresh.counts)
+    np.testing.assert_allclose(dataset.get_fit_sums(), fresh.get_fit_sums())
+
+def test_fit_with_fewer_than_2_days_after_quality_pass():
+    """The single location fit is NaN instead of failing when the quality pass leaves fewer than 2 days."""
+    data = covid19.Covid19Data('Italy', DATA_FILE, covid19.DataLocation.country_region)
+    x_y_dates = data.get_covid19_data(data.set_start_end_dates('1/22/20', '1/25/20'))
+    x_y_dates, report = data.clean(x_y_dates, 'drop')
+    assert report.zeros.all()
+
+    ln_y, fit_line, fit = data.fit(x_y_dates)
+    assert np.isnan(fit_line).all()
+    assert all(np.isnan(value) for value in fit)
+
+def test_clean_cases_policies():
+    """Revisions, zero days and spikes are flagged, and every policy changes only those days."""
+    values = np.array([[0, 0, 5, 10, 30, 12, 14, 13, 20, 25],
+                       [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]])
+    revisions, zeros, spikes = covid19.find_quality_issues(values)
+    np.testing.assert_array_equal(np.flatnonzero(zeros[0]), [0, 1])
+    np.testing.assert_array_equal(np.flatnonzero(spikes[0]), [4, 6])
+    assert not revisions[0].any() and not (revisions[1] | zeros[1] | spikes[1]).any()
+
+    expected = {'none': [0, 0, 5, 10, 30, 12, 14, 13, 20, 25],
+                'drop': [np.nan, np.nan, 5, 10, np.nan, 12, np.nan, 13, 20, 25],
+                'clip': [np.nan, np.nan, 5, 10, 10, 12, 12, 13, 20, 25],
+                'interpolate': [np.nan, np.nan, 5, 10, np.sqrt(10 * 12), 12, np.sqrt(12 * 13), 13, 20, 25]}
+    for policy, row in expected.items():
+        cleaned, report = covid19.clean_cases(values, policy)
+        np.testing.assert_allclose(cleaned[0], row)
+        np.testing.assert_array_equal(cleaned[1], values[1])
+        assert not report.changed[1].any()
+
+def test_get_date_indices_formats():
+    """Date strings in the user formats, datetime and datetime64 values give the same positions, invalid dates raise ValueError."""
+    dataset = Covid19Dataset(DATA_FILE)
+    expected = dataset.get_date_indices('3/1/20', 'Mar/05/2020')
+    for start, end in [('2020-03-01', '03/05/2020'), (np.datetime64('2020-03-01'), datetime.datetime(2020, 3, 5)),
+                       (datetime.date(2020, 3, 1), np.datetime64('2020-03-05T12:00'))]:
+        assert dataset.get_date_indices(start, end) == expected
+    for value in ['2/30/20', '2020-13-01', 'Mar/32/2020', np.datetime64('NaT')]:
+        with pytest.raises(ValueError):
+            dataset.get_date_indices(value, None)
+
+def test_rolling_fit_matches_fit_of_every_window():
+    """rolling_fit gives the fit of every window, nearly flat windows keep their slope and flat windows have a slope of 0."""
+    from numpy.lib.stride_tricks import sliding_window_view
+    names, data_locations, matrix = Covid19Dataset(DATA_FILE).get_location_matrix()
+    ln_y = covid19.log_cases(matrix)
+    starts, fit = covid19.rolling_fit(ln_y, 14)
+
+    windows = sliding_window_view(ln_y, 14, axis=1)
+    expected = covid19.fit_log_linear(np.arange(1, 15, dtype=float), windows.reshape(-1, 14))
+    flat = np.ptp(windows, axis=2) == 0
+    np.testing.assert_allclose(fit.slope, expected.slope.reshape(flat.shape), atol=1e-10)
+    np.testing.assert_allclose(fit.intercept, expected.intercept.reshape(flat.shape), atol=1e-9)
+    np.testing.assert_allclose(fit.r_squared[~flat], expected.r_squared.reshape(flat.shape)[~flat], atol=1e-7)
+    assert (fit.slope[flat] == 0).all() and np.isnan(fit.r_squared[flat]).all()
+
+    #A plateau growing by 0.005% a day is not flat
+    plateau = np.log(1e5) + 5e-5 * np.arange(30)
+    np.testing.assert_allclose(covid19.rolling_fit(plateau, 14)[1].slope, 5e-5)
+
+def test_batch_fit_matches_fit_log_linear():
+    """The batch fit of the whole history (running sums) and of a date range match fit_log_linear and np.polyfit."""
+    dataset = Covid19Dataset(DATA_FILE)
+    names, data_locations, matrix = dataset.get_location_matrix()
+    ln_y = covid19.log_cases(matrix)
+    expected = covid19.fit_log_linear(np.arange(1, ln_y.shape[1] + 1, dtype=float), ln_y)
+    results = covid19.batch_fit(dataset)
+    np.testing.assert_allclose(results['slope'], expected.slope, atol=1e-12)
+    np.testing.assert_allclose(results['r_squared'], expected.r_squared, atol=1e-9)
+
+    results = covid19.batch_fit(dataset, '3/21/20', '4/5/20')
+    start_idx, end_idx = dataset.get_date_indices('3/21/20', '4/5/20')
+    for row in [names.index('Italy'), names.index('Quebec'), len(names) - 1]:
+        slope, intercept = np.polyfit(np.arange(1, end_idx - start_idx + 2), ln_y[row, start_idx:end_idx+1], 1)
+        np.testing.assert_allclose([results['slope'][row], results['intercept'][row]], [slope, intercept])
+
+@pytest.fixture
+def server(data_frame, tmp_path):
+    path = str(tmp_path / 'confirmed.csv')
+    data_frame.to_csv(path, index=False)
+    return covid19.Covid19Server(path)
+
+def get_json(server, path):
+    status, content_type, body = server.handle(path)
+    assert content_type == 'application/json'
+    return status, json.loads(body)
+
+def test_server_fit_and_plot(server):
+    """/fit gives the fit statistics of the location and dates, /plot a PNG image, both are served from the caches again."""
+    status, fit = get_json(server, '/fit?country=italy&start=3/21/20&end=4/5/20')
+    assert status == 200
+    assert (fit['location'], fit['data_location'], fit['start_date'], fit['end_date']) == ('Italy', 'country_region', '3/21/20', '4/5/20')
+    assert round(fit['doubling_time'], 2) == 12.07
+    assert get_json(server, '/fit?country=Italy&start=3/21/20&end=4/5/20') == (200, fit)
+
+    status, world = get_json(server, '/fit?world=1&start=6/20/20&end=6/30/20')
+    assert status == 200 and round(world['doubling_time'], 2) == 39.53
+
+    status, content_type, image = server.handle('/plot?province=Quebec&start=3/1/20&end=3/23/20')
+    assert (status, content_type) == (200, 'image/png')
+    assert image.startswith(b'\x89PNG')
+    assert server.handle('/plot?province=quebec&start=3/1/20&end=3/23/20')[2] is image
+
+def test_server_locations(server, data_frame):
+    status, names = get_json(server, '/locations')
+    assert status == 200
+    assert set(names['country_region']) == set(data_frame['Country/Region'])
+    assert 'Quebec' in names['province_state']
+
+def test_server_errors(server):
+    """Unknown paths and locations are 404, a missing location or a bad parameter value is 400."""
+    assert get_json(server, '/unknown')[0] == 404
+    assert get_json(server, '/fit?country=Atlantis')[0] == 404
+    assert get_json(server, '/fit')[0] == 400
+    assert get_json(server, '/fit?world=0')[0] == 400
+    assert get_json(server, '/fit?country=Italy&start=not a date')[0] == 400
+    assert get_json(server, '/fit?country=Italy&snap=maybe')[0] == 400
+
+def test_server_snap_flag(server):
+    """snap=0 and snap=false do not snap a date that is not in the data to the nearest date."""
+    assert get_json(server, '/fit?country=Italy&start=1/1/19&end=4/5/20&snap=1')[0] == 200
+    for value in ['0', 'false', '']:
+        assert get_json(server, '/fit?country=Italy&start=1/1/19&end=4/5/20&snap=' + value)[0] == 400
+
+def test_server_reload(server, data_frame):
+    """A changed data file is loaded again with a new generation in the cache keys, fits are not served from before."""
+    query = {'country': 'Italy', 'start': '3/21/20'}
+    key, location_fit = server._get_location_fit(query)
+    assert key[-1] == 0
+    assert not server.reload_if_changed()
+
+    data_frame.iloc[:, :-1].to_csv(server._url, index=False)
+    os.utime(server._url, ns=(0, 0))
+    assert server.reload_if_changed()
+    reloaded_key, reloaded_fit = server._get_location_fit(query)
+    assert reloaded_key[-1] == 1
+    assert reloaded_fit.end_date == data_frame.columns[-2] != location_fit.end_date
+    assert get_json(server, '/fit?country=Italy&start=3/21/20')[1]['end_date'] == data_frame.columns[-2]
+
+def test_export_round_trip(tmp_path):
+    """A dataset exported to the columnar format opens memory-mapped with the same data and fits as the CSV file."""
+    dataset = Covid19Dataset(DATA_FILE)
+    path = str(tmp_path / 'columnar')
+    dataset.export(path)
+    assert covid19.is_columnar_dataset(path)
+
+    exported = Covid19Dataset(path)
+    assert isinstance(exported.counts, np.memmap)
+    np.testing.assert_array_equal(exported.counts, dataset.counts)
+    np.testing.assert_array_equal(exported.dates, dataset.dates)
+    assert exported.date_columns == dataset.date_columns
+    np.testing.assert_array_equal(exported.provinces, dataset.provinces)
+    np.testing.assert_array_equal(exported.countries, dataset.countries)
+    np.testing.assert_allclose(exported.get_fit_sums(), dataset.get_fit_sums())
+    pd.testing.assert_frame_equal(covid19.batch_fit(exported, '3/1/20', '3/15/20'), covid19.batch_fit(dataset, '3/1/20', '3/15/20'))
+
+    for location, data_location in [('Quebec', covid19.DataLocation.province_state), ('Canada', covid19.DataLocation.country_region),
+                                    ('The World', covid19.DataLocation.world)]:
+        name, values = exported.find_location(location, data_location)
+        np.testing.assert_array_equal(values, dataset.find_location(location, data_location)[1])
+
+def test_find_location_country_total_is_summed_once():
+    dataset = Covid19Dataset(DATA_FILE)
+    name, values = dataset.find_location('canada', covid19.DataLocation.country_region)
+    assert name == 'Canada'
+    assert dataset.find_location('Canada', covid19.DataLocation.country_region)[1] is values
+    np.testing.assert_array_equal(values, dataset.country_totals[dataset.location_names(covid19.DataLocation.country_region).index('Canada')])
+
+def test_stream_global_layout(data_frame):
+    """The streamed rows and dates of the global file are the same as in the loaded dataset, misspelled names are matched too."""
+    dataset = Covid19Dataset(DATA_FILE)
+    locations = [('quebek', covid19.DataLocation.province_state), ('italy', covid19.DataLocation.country_region)]
+    table = covid19.stream_time_series_csv(DATA_FILE, locations, '3/1/20', '4/5/20', chunk_rows=50)
+    start_idx, end_idx = dataset.get_date_indices('3/1/20', '4/5/20')
+    assert table.date_columns == dataset.date_columns[start_idx:end_idx + 1]
+    assert list(table.provinces) == ['Quebec', ''] and list(table.countries) == ['Canada', 'Italy']
+    for row, (name, data_location) in enumerate(locations):
+        np.testing.assert_array_equal(table.counts[row], dataset.find_location(name, data_location)[1][start_idx:end_idx + 1])
+
+    with pytest.raises(KeyError):
+        covid19.stream_time_series_csv(DATA_FILE, [('Atlantis', covid19.DataLocation.country_region)])
+
+def test_stream_us_layout(tmp_path):
+    """The counties of a state in the US layout are summed into one row per state."""
+    path = str(tmp_path / 'confirmed_US.csv')
+    with open(path, 'w') as f:
+        f.write('UID,iso2,iso3,code3,FIPS,Admin2,Province_State,Country_Region,Lat,Long_,Combined_Key,1/22/20,1/23/20,1/24/20\n'
+                '84036001,US,USA,840,36001.0,Albany,New York,US,42.6,-73.9,"Albany, New York, US",1,2,3\n'
+                '84006001,US,USA,840,6001.0,Alameda,California,US,37.6,-121.9,"Alameda, California, US",0,0,1\n'
+                '84036005,US,USA,840,36005.0,Bronx,New York,US,40.8,-73.8,"Bronx, New York, US",10,20,\n')
+
+    table = covid19.stream_time_series_csv(path, [('new york', covid19.DataLocation.province_state)], '1/23/20', chunk_rows=1)
+    assert table.date_columns == ['1/23/20', '1/24/20']
+    assert (list(table.provinces), list(table.countries)) == (['New York'], ['US'])
+    np.testing.assert_array_equal(table.counts, [[22, 3]])
+    assert (table.lat[0], table.long[0]) == (42.6, -73.9)
+
+    world = covid19.stream_time_series_csv(path, [('The World', covid19.DataLocation.world)])
+    assert list(world.provinces) == ['New York', 'California']
+    np.testing.assert_array_equal(world.counts.sum(axis=0), [11, 22, 4])
+
+def test_multi_batch_fit_quality_and_resamples(data_frame, tmp_path):
+    """The quality pass and the bootstrap are applied to every series of the multi-file fit, same as batch_fit."""
+    deaths_path = str(tmp_path / 'deaths.csv')
+    deaths = data_frame.copy()
+    deaths.iloc[:, 4:] = deaths.iloc[:, 4:] // 50
+    deaths.to_csv(deaths_path, index=False)
+
+    multi_dataset = covid19.Covid19MultiDataset({'confirmed': DATA_FILE, 'deaths': deaths_path}, max_workers=1)
+    results = covid19.multi_batch_fit(multi_dataset, '3/1/20', '4/15/20', resamples=100, quality='drop')
+    expected = covid19.batch_fit(Covid19Dataset(DATA_FILE), '3/1/20', '4/15/20', resamples=100, quality='drop')
+    merged = results.merge(expected, on=['location', 'data_location'])
+    assert len(merged) == len(results)
+    for field in ['slope', 'r_squared', 'slope_stderr', 'changed_days']:
+        np.testing.assert_allclose(merged['confirmed_' + field], merged[field])
+    assert results['confirmed_slope_low'].notna().any() and results['deaths_changed_days'].sum() > 0
+
+def test_cache_hit_and_stale_entry(data_frame, tmp_path, monkeypatch):
+    """An unchanged file is loaded from the cache without parsing it, a changed file makes the entry stale."""
+    path = str(tmp_path / 'confirmed.csv')
+    cache = Covid19Cache(str(tmp_path / 'cache'))
+    data_frame.to_csv(path, index=False)
+    dataset = Covid19Dataset(path, cache)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(covid19, 'read_time_series_csv', None)
+        cached = Covid19Dataset(path, cache)
+    assert isinstance(cached.counts, np.memmap)
+    np.testing.assert_array_equal(cached.counts, dataset.counts)
+    np.testing.assert_array_equal(cached.provinces, dataset.provinces)
+    assert cached.date_columns == dataset.date_columns
+
+    #The validator of a local file is the hash of its content
+    with open(path, 'rb') as f:
+        validator = 'sha1:' + covid19.hashlib.sha1(f.read()).hexdigest()
+    assert cache.load(path, validator) is not None
+    assert cache.load(path, 'sha1:0') is None
+    assert cache.load(path)[0]['validator'] == validator
+
+    changed = data_frame.copy()
+    changed.iloc[0, 4] += 1
+    changed.to_csv(path, index=False)
+    assert cache.load(path, validator) is not None
+    reloaded = Covid19Dataset(path, cache)
+    assert reloaded.counts[0, 0] == dataset.counts[0, 0] + 1
+    assert cache.load(path, validator) is None
+
+def test_cache_eviction(data_frame, tmp_path):
+    """Entries older than max_age are removed, then the least recently used entries until the cache fits in max_bytes."""
+    cache_dir = str(tmp_path / 'cache')
+    paths = []
+    for idx in range(3):
+        paths.append(str(tmp_path / ('confirmed%d.csv' % idx)))
+        data_frame.iloc[:, :10 + idx].to_csv(paths[-1], index=False)
+        Covid19Dataset(paths[-1], Covid19Cache(cache_dir))
+
+    #Entries are used in the order 1, 0, 2, load would mark them as used so the files are checked instead
+    json_paths = [Covid19Cache(cache_dir)._entry_paths(path)[1] for path in paths]
+    for age, json_path in zip([20, 30, 10], json_paths):
+        os.utime(json_path, (covid19.time.time() - age, covid19.time.time() - age))
+
+    entry_size = sum(os.path.getsize(entry_path) for entry_path in Covid19Cache(cache_dir)._entry_paths(paths[2]))
+    Covid19Cache(cache_dir, max_bytes=2 * entry_size + 1).evict()
+    assert [os.path.exists(json_path) for json_path in json_paths] == [True, False, True]
+
+    Covid19Cache(cache_dir, max_age=15).evict()
+    assert [os.path.exists(json_path) for json_path in json_paths] == [False, False, True]
+
+def run_main(monkeypatch, argv):
+    """Run the command line with argv, returns the parsed arguments."""
+    parsed = []
+    monkeypatch.setattr('sys.argv', ['covid19_linear_plot.py'] + argv)
+    monkeypatch.setattr(covid19, 'run', parsed.append)
+    covid19.main()
+    return parsed[0]
+
+def test_locations_in_command_line_order(monkeypatch, capsys):
+    """-p, -c and -w locations are kept in the order they are given, for the fits and the comparison plot."""
+    args = run_main(monkeypatch, ['-c', 'Italy', '-w', '-p', 'Quebec', '-c', 'Spain', '-w'])
+    assert args.locations == [('Italy', covid19.DataLocation.country_region), ('The World', covid19.DataLocation.world),
+                              ('Quebec', covid19.DataLocation.province_state), ('Spain', covid19.DataLocation.country_region)]
+    assert args.country_region == ['Italy', 'Spain'] and args.province_state == ['Quebec']
+    assert run_main(monkeypatch, ['-u', DATA_FILE]).locations is None
+
+    monkeypatch.undo()
+    args.url, args.no_plot, args.no_cache = DATA_FILE, True, True
+    covid19.run(args)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(':')[0] for line in lines] == ['Italy', 'The World', 'Quebec', 'Spain']
@@ -0,0 +1,46 @@
+import numpy as np
+from covid19_statistics import fit_statistics, bootstrap_intervals
+"""
+
+Tests of the fit statistics of the COVID-19 Linear Plot Tool
+
+"""
+
+def make_series(seed=1):
+    """Noisy log-linear rows with missing (NaN) days in some of them."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(1, 21, dtype=float)
+    ln_y = 0.1 * x + rng.normal(0, 0.1, (6, 20))
+    ln_y[1, :3] = np.nan
+    ln_y[2, [5, 9]] = np.nan
+    ln_y[3, 1:] = np.nan
+    return x, ln_y
+
+def test_fit_statistics_leaves_out_missing_days():
+    """Rows with NaN days are fitted over their other days, rows with fewer than 2 days have no fit."""
+    x, ln_y = make_series()
+    fit = fit_statistics(x, ln_y)
+    for row in [0, 1, 2, 4, 5]:
+        valid = np.isfinite(ln_y[row])
+        slope, intercept = np.polyfit(x[valid], ln_y[row, valid], 1)
+        np.testing.assert_allclose([fit.slope[row], fit.intercept[row]], [slope, intercept])
+    assert np.isnan(fit.slope[3])
+
+    #Complete rows have the same fit as without the other rows
+    complete = fit_statistics(x, ln_y[[0, 4, 5]])
+    for values, complete_values in zip(fit, complete):
+        np.testing.assert_allclose(values[[0, 4, 5]], complete_values)
+
+def test_bootstrap_intervals_with_missing_days():
+    """Intervals contain the fitted slope, and the complete rows do not depend on the rows with missing days."""
+    x, ln_y = make_series()
+    fit, intervals = bootstrap_intervals(x, ln_y, resamples=500)
+    rows = [0, 1, 2, 4, 5]
+    assert (intervals.slope_low[rows] < fit.slope[rows]).all() and (fit.slope[rows] < intervals.slope_high[rows]).all()
+    assert np.isnan(intervals.slope_low[3])
+
+    complete_fit, complete_intervals = bootstrap_intervals(x, ln_y[[0, 4, 5]], resamples=500)
+    np.testing.assert_array_equal(intervals.slope_low[[0, 4, 5]], complete_intervals.slope_low)
+
+    _, chunked_intervals = bootstrap_intervals(x, ln_y, resamples=500, processes=2, chunk_rows=2)
+    np.testing.assert_allclose(chunked_intervals.slope_low, intervals.slope_low)